@@ -0,0 +1,118 @@
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+import pandas
+
+import generate_data
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_FILE = os.path.join(BENCHMARK_DIR, "..", "iserv-import.py")
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+SIZES = [300, 1000, 3000]
+REPEATS = 3
+SEED = 1
+# stages which are slower by more than this factor are reported as regressions
+REGRESSION_THRESHOLD = 1.2
+
+def load_script():
+    spec = importlib.util.spec_from_file_location("iserv_import", SCRIPT_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # measure the stages themselves, not the cache or the delta state
+    module.USE_CACHE = False
+    module.DELTA_MODE = False
+    module.STREAM_OUTPUT = False
+    return module
+
+def get_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=BENCHMARK_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+# runs all stages of one import one after another and returns the time of every stage
+def run_stages(script, data_dir, out_dir):
+    timings = {}
+
+    def measure(stage, function):
+        start = time.perf_counter()
+        result = function()
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        loader = script.SourceLoader()
+        students = script.Students(os.path.join(data_dir, "sus2.csv"), os.path.join(data_dir, "GOMSTH.csv"), os.path.join(data_dir, "GPU002.TXT"), os.path.join(out_dir, "Iserv SuS.csv"), loader=loader)
+        teachers = script.Teachers(os.path.join(data_dir, "LuL5.csv"), os.path.join(data_dir, "GPU002.TXT"), os.path.join(data_dir, "GPU003.TXT"), os.path.join(out_dir, "Iserv LuL.csv"), os.path.join(out_dir, "group_owners.csv"), [], loader=loader)
+        measure("students: read", students.read_data)
+        measure("students: format", students.format_students)
+        measure("students: write", students.write_iserv)
+        measure("teachers: read", teachers.read_data)
+        teachers.set_control_groups_students(students.get_control_groups())
+        measure("teachers: format", teachers.format_teachers)
+        measure("teachers: write", lambda: (teachers.write_iserv(), teachers.write_group_owners_file()))
+        measure("reconcile groups", lambda: script.reconcile_groups(teachers.get_control_groups(), students.get_control_groups(), teachers.deleted_groups, students.deleted_groups))
+    return timings
+
+def run_benchmarks(sizes, repeats, seed):
+    script = load_script()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            data_dir = os.path.join(directory, str(size), "data-src")
+            out_dir = os.path.join(directory, str(size), "data-out")
+            os.makedirs(out_dir)
+            generate_data.generate(data_dir, size, seed=seed)
+            runs = [run_stages(script, data_dir, out_dir) for i in range(repeats)]
+            for stage in runs[0]:
+                times = [run[stage] for run in runs]
+                results.append({"size": size, "stage": stage, "min": min(times), "median": statistics.median(times), "max": max(times)})
+                print(str(size).rjust(6), stage.ljust(18), format(min(times) * 1000, "10.1f"), "ms (median", format(statistics.median(times) * 1000, ".1f"), "ms)")
+    return results
+
+def compare(results, previous_file):
+    with open(previous_file, encoding="utf-8") as file:
+        previous = json.load(file)
+    previous_results = {(result["size"], result["stage"]): result for result in previous["results"]}
+    print("----------------------------")
+    print("### compared to", previous["version"], "###")
+    regressions = 0
+    for result in results:
+        old = previous_results.get((result["size"], result["stage"]))
+        if(old is None or old["min"] == 0):
+            continue
+        factor = result["min"] / old["min"]
+        marker = ""
+        if(factor > REGRESSION_THRESHOLD):
+            marker = "  <- regression"
+            regressions += 1
+        print(str(result["size"]).rjust(6), result["stage"].ljust(18), format(old["min"] * 1000, "10.1f"), "ms ->", format(result["min"] * 1000, "10.1f"), "ms", format(factor, "6.2f") + "x" + marker)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the stages of iserv-import.py on generated schools of different sizes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="numbers of students")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--output", help="results file (default: results/<version>.json)")
+    parser.add_argument("--compare", help="results file of another version")
+    arguments = parser.parse_args()
+
+    version = get_version()
+    results = run_benchmarks(arguments.sizes, arguments.repeats, arguments.seed)
+    output = arguments.output or os.path.join(RESULTS_DIR, version + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({"version": version, "date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(), "pandas": pandas.__version__, "seed": arguments.seed, "repeats": arguments.repeats, "results": results}, file, indent=1)
+    print("results written to", output)
+    if(arguments.compare is not None and compare(results, arguments.compare) > 0):
+        raise SystemExit(1)
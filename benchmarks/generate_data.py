@@ -0,0 +1,182 @@
+import argparse
+import csv
+import os
+import random
+
+FIRST_NAMES = ["Anna", "Lukas", "Marie", "Paul", "Sophie", "Jan-Erik", "Lena", "Jonas", "Emma", "Felix", "Mia", "Ben", "Lea", "Tim", "Jörg", "Ömer", "Zoë", "Karl", "Greta", "Noah"]
+LAST_NAMES = ["Müller", "Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner", "Becker", "Schulz", "Hoffmann", "Koch", "Richter", "Klein", "Wolf", "Schröder", "Neumann", "Schwarz", "Zimmermann", "Braun", "Krüger", "von Bergen", "Yılmaz"]
+
+SEKI_GRADES = ["5", "6", "7", "8", "9"]
+# grade in SchILD -> grade in GOMSTH
+SEKII_GRADES = {"EF": "10", "Q1": "11", "Q2": "12"}
+SEKI_SUBJECTS = ["D", "M", "E", "BI", "PH", "CH", "GE", "EK", "KR", "ER", "PP", "SP", "MU", "KU", "F6", "L6"]
+# (subject, number of the subject in UNTIS, can be a LK)
+SEKII_SUBJECTS = [("M", "", True), ("D", "", True), ("E", "", True), ("BI", "", True), ("PH", "", False), ("CH", "", False), ("GE", "", True), ("EK", "", False), ("KR", "", False), ("PL", "", False), ("F", "6", False), ("L", "6", False), ("MU", "", False), ("KU", "", False), ("IF", "", False)]
+STUDENTS_PER_CLASS = 28
+UNTIS_COLUMNS = 42
+
+class Generator:
+
+    def __init__(self, students, teachers, courses, seed):
+        self.students = students
+        self.teachers_count = teachers
+        self.courses = courses
+        self.random = random.Random(seed)
+        self.untis = []
+        self.teachers = []
+
+    def __get_name(self):
+        names = self.random.sample(FIRST_NAMES, self.random.choice([1, 1, 2, 2, 3]))
+        if(len(names) > 1 and self.random.random() < 0.5):
+            # the main name is written in uppercase in SchILD
+            main = self.random.randrange(len(names))
+            names[main] = names[main].upper()
+        return " ".join(names)
+
+    def __get_last_name(self):
+        if(self.random.random() < 0.3):
+            return "-".join(self.random.sample(LAST_NAMES, 2))
+        return self.random.choice(LAST_NAMES)
+
+    def __add_lesson(self, grade, teacher, subject):
+        row = [""] * UNTIS_COLUMNS
+        row[0] = str(len(self.untis) + 1)
+        row[4] = grade
+        row[5] = teacher["code"]
+        row[6] = subject
+        self.untis.append(row)
+
+    def __generate_teachers(self):
+        codes = set()
+        while(len(self.teachers) < self.teachers_count):
+            code = "".join(self.random.choice("ABCDEFGHIJKLMNOPRSTUVWZ") for i in range(3))
+            if(code in codes):
+                continue
+            codes.add(code)
+            self.teachers.append({"code": code, "first": self.__get_name().title(), "last": self.random.choice(LAST_NAMES), "groups": set()})
+
+    # SEKI: every class has lessons of most subjects, the groups are named "<subject> <grade>"
+    def __generate_seki(self):
+        classes_per_grade = max(1, round(self.students * 0.6 / len(SEKI_GRADES) / STUDENTS_PER_CLASS))
+        self.classes = [grade + chr(ord("a") + number) for grade in SEKI_GRADES for number in range(classes_per_grade)]
+        self.class_subjects = {}
+        for school_class in self.classes:
+            subjects = self.random.sample(SEKI_SUBJECTS, 11)
+            self.class_subjects[school_class] = subjects
+            for subject in subjects:
+                teacher = self.random.choice(self.teachers)
+                self.__add_lesson(school_class, teacher, subject[:-1] if subject[-1].isdigit() else subject)
+                teacher["groups"].add(subject + " " + school_class[0])
+
+    # SEKII: LK and GK courses per subject and grade, GOMSTH references them by subject, course number and teacher
+    def __generate_sekii(self):
+        self.sekii_courses = {}
+        for grade, gomsth_grade in SEKII_GRADES.items():
+            courses = []
+            for subject, number, has_lk in SEKII_SUBJECTS:
+                untis_subject = subject + number
+                course_types = [("G", self.courses)]
+                if(has_lk and grade != "EF"):
+                    course_types.append(("L", max(1, self.courses // 2)))
+                for course_type, count in course_types:
+                    for course_number in range(1, count + 1):
+                        teacher = self.random.choice(self.teachers)
+                        self.__add_lesson(grade, teacher, untis_subject + " " + course_type + str(course_number))
+                        if(course_type == "L"):
+                            gomsth_subject = untis_subject.upper()
+                            gomsth_number = self.random.choice([str(course_number), chr(ord("A") + course_number - 1)])
+                        else:
+                            gomsth_subject = untis_subject.lower()
+                            gomsth_number = str(course_number)
+                        courses.append((gomsth_subject, gomsth_number, teacher["code"]))
+            # sports courses are numbered per sport in GOMSTH
+            for course_number in range(1, self.courses + 1):
+                teacher = self.random.choice(self.teachers)
+                self.__add_lesson(grade, teacher, "SP G" + str(course_number))
+                courses.append(("sp" + str(self.random.randint(1, 3)), str(course_number), teacher["code"]))
+            # additional courses
+            teacher = self.random.choice(self.teachers)
+            self.__add_lesson(grade, teacher, "GE Z1")
+            courses.append(("gn", "1", teacher["code"]))
+            self.__add_lesson(grade, teacher, "SPT G1")
+            self.sekii_courses[grade] = courses
+        # UNTIS often contains the same lesson twice
+        self.untis.append(list(self.untis[-3]))
+
+    def __generate_students(self):
+        self.schild = []
+        self.gomsth = []
+        grades = self.classes + list(SEKII_GRADES)
+        for position in range(self.students):
+            if(position < len(grades)):
+                grade = grades[position]
+            elif(self.random.random() < 0.4):
+                grade = self.random.choice(list(SEKII_GRADES))
+            else:
+                grade = self.random.choice(self.classes)
+            first_name = self.__get_name()
+            last_name = self.__get_last_name()
+            if(grade in SEKII_GRADES):
+                groups = ["Fuellsel", "KR " + grade]
+                courses = self.random.sample(self.sekii_courses[grade], min(12, len(self.sekii_courses[grade]), self.random.randint(9, 12)))
+                call_name = first_name if self.random.random() < 0.8 else first_name.split(" ")[0].title()
+                row = {"FAMILIENNAME": last_name, "VORNAME": first_name, "RUFNAME": call_name, "KLASSE": SEKII_GRADES[grade] if self.random.random() < 0.9 else grade}
+                for number in range(1, 13):
+                    subject, course_number, teacher = courses[number - 1] if number <= len(courses) else ("", "", "")
+                    row["FACH" + str(number)] = subject
+                    row["KURSNR" + str(number)] = course_number
+                    row["FACHLEHRERKÜRZEL" + str(number)] = teacher
+                # some students are missing in GOMSTH
+                if(self.random.random() < 0.98):
+                    self.gomsth.append(row)
+            else:
+                groups = [subject + " " + grade[0] for subject in self.random.sample(self.class_subjects[grade], 8)] + ["Fuellsel 1"]
+                # groups which don't exist in UNTIS
+                if(self.random.random() < 0.2):
+                    groups.append("AG" + str(self.random.randint(1, 5)) + " " + grade[0])
+            self.schild.append({"Nachname": last_name, "Vorname": first_name, "Klasse": grade, "Import-ID": str(10000 + position), "Gruppen": ";".join(groups) if self.random.random() < 0.98 else "", "Geburtsdatum": "01.0" + str(self.random.randint(1, 9)) + ".20" + str(self.random.randint(5, 14)).zfill(2)})
+
+    def write(self, directory, encoding="utf-8"):
+        self.__generate_teachers()
+        self.__generate_seki()
+        self.__generate_sekii()
+        self.__generate_students()
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "GPU002.TXT"), "w", newline="", encoding=encoding) as file:
+            csv.writer(file).writerows(self.untis)
+        with open(os.path.join(directory, "GPU003.TXT"), "w", newline="", encoding=encoding) as file:
+            writer = csv.writer(file)
+            for grade in self.classes + list(SEKII_GRADES):
+                teachers = self.random.sample(self.teachers, min(2, len(self.teachers)))
+                writer.writerow([grade, " ".join([grade] + [teacher["code"] for teacher in teachers])])
+        with open(os.path.join(directory, "sus2.csv"), "w", newline="", encoding=encoding) as file:
+            writer = csv.DictWriter(file, ["Nachname", "Vorname", "Klasse", "Import-ID", "Gruppen", "Geburtsdatum"], delimiter=";")
+            writer.writeheader()
+            writer.writerows(self.schild)
+        # GOMSTH is exported in Windows 1252
+        with open(os.path.join(directory, "GOMSTH.csv"), "w", newline="", encoding="cp1252", errors="replace") as file:
+            columns = ["FAMILIENNAME", "VORNAME", "RUFNAME", "KLASSE"] + [column + str(number) for number in range(1, 13) for column in ["FACH", "KURSNR", "FACHLEHRERKÜRZEL"]]
+            writer = csv.DictWriter(file, columns)
+            writer.writeheader()
+            writer.writerows(self.gomsth)
+        with open(os.path.join(directory, "LuL5.csv"), "w", newline="", encoding=encoding) as file:
+            writer = csv.writer(file, delimiter=";")
+            writer.writerow(["Nachname", "Vorname", "Information", "ID", "Gruppen"])
+            for position, teacher in enumerate(self.teachers):
+                writer.writerow([teacher["last"], teacher["first"], teacher["code"], "L" + str(position), ";".join(sorted(teacher["groups"]) + ["Fuellsel"]) if len(teacher["groups"]) > 0 else ""])
+
+# writes SchILD, GOMSTH and UNTIS files of a school with the given size (always the same files for the same arguments)
+def generate(directory, students, teachers=None, courses=2, seed=1):
+    if(teachers is None):
+        teachers = max(5, students // 12)
+    Generator(students, teachers, courses, seed).write(directory)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic source files for iserv-import.py")
+    parser.add_argument("directory", help="output directory, e.g. data-src/")
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--teachers", type=int, default=None, help="default: students / 12")
+    parser.add_argument("--courses", type=int, default=2, help="GK courses per subject and grade")
+    parser.add_argument("--seed", type=int, default=1)
+    arguments = parser.parse_args()
+    generate(arguments.directory, arguments.students, arguments.teachers, arguments.courses, arguments.seed)
@@ -1,7 +1,36 @@
 import pandas
+import argparse
+import codecs
+import collections
+import concurrent.futures
+import contextlib
 import csv
+import functools
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import multiprocessing
 import os
+import queue
 import re
+import sys
+import threading
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+import time
+import tracemalloc
+import traceback
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # only needed for the snapshot
+    pyarrow = None
 
 # productive environment
 DATA_SRC = "data-src/"
@@ -16,9 +45,25 @@ ISERV_SUS_FILE = DATA_OUT + "Iserv SuS.csv"
 ISERV_LUL_FILE = DATA_OUT + "Iserv LuL.csv"
 GROUP_OWNERS_FILE = DATA_OUT + "group_owners.csv"
 
+# parsed source files are kept here, so unchanged files don't have to be parsed again in the next run
+DATA_CACHE = "data-cache/"
+USE_CACHE = True
+
+# write the iServ files while formatting instead of writing them at the end (not used in delta mode)
+STREAM_OUTPUT = False
+# number of rows which are formatted and written at once when streaming
+STREAM_CHUNK_SIZE = 500
+
+# only recompute students and teachers whose inputs (or mappings) changed since the last run and write additional
+# "added", "changed" and "removed" files next to the output files
+DELTA_MODE = False
+DELTA_STATE_FILE = DATA_CACHE + "delta_state.json"
+
 GOMSTH_MAX_COURSES = 12
 VERBOSE = False
 SUPPRESS_DUPLICATES = True
+# engine for formatting students: "vectorized" (column-wise) or "loop" (row by row, the old engine)
+STUDENTS_ENGINE = "vectorized"
 
 # map computed group names to correct group names (e.g. for downgraded LK groups to LK groups)
 MANUAL_SEKII_COURSE_MAPPINGS = {"example_computed_course": "example_correct_course",
@@ -40,70 +85,392 @@ MANUAL_USERNAME_MAPPINGS = {"example_username": "example_correct_username"}
 MANUAL_TEACHER_NAME_MAPPINGS = {"example firstname": "example correct firstname"}
 MANUAL_TEACHER_SURNAME_MAPPINGS = {"example lastname": "example correct lastname"}
 
+# groups which are ignored and groups which are kept without checking them in UNTIS (only for students)
+SKIPPED_GROUPS = ["prefix:Fuellsel"]
+KEPT_STUDENT_GROUPS = ["prefix:Austausch"]
+
+# additional rules for all mappings and group lists above (e.g. maintained by the school), see README
+MAPPINGS_FILE = "mappings.json"
+
+# what to do if multiple teachers get the same username: "warn" (only log an error) or "number" (append a number to the later usernames)
+USERNAME_COLLISION_POLICY = "warn"
+
+# number of threads for running independent phases (reading files, formatting students and teachers) at the same time
+SCHEDULER_THREADS = 4
+
+# read options of all source files: additionally to the options of pandas.read_csv, only the "columns" are read (if they exist)
+# and the "categories" are stored as categorical columns (for values which repeat a lot like teachers, subjects and grades)
+def get_gomsth_course_columns(max_courses):
+    return [column + str(i) for i in range(1, max_courses + 1) for column in ["FACH", "KURSNR", "FACHLEHRERKÜRZEL"]]
+
+def get_source_options(gomsth_course_columns):
+    return {"schild": {"sep": ";"},
+            "gomsth": {"sep": ",", "dtype": str, "columns": ["FAMILIENNAME", "RUFNAME", "KLASSE"] + gomsth_course_columns,
+                       "categories": ["KLASSE"] + [column for column in gomsth_course_columns if not column.startswith("KURSNR")]},
+            "untis": {"sep": ",", "header": None, "dtype": str, "columns": [4, 5, 6, 41], "categories": [4, 5, 6, 41]},
+            "class_teachers": {"sep": ",", "header": None}}
+
+GOMSTH_COURSE_COLUMNS = get_gomsth_course_columns(GOMSTH_MAX_COURSES)
+SOURCE_OPTIONS = get_source_options(GOMSTH_COURSE_COLUMNS)
+
+# batch mode: directory with one config file (<school>.json) per school and number of schools imported at the same time
+SCHOOLS_DIR = "schools/"
+BATCH_PROCESSES = 4
+BATCH_SUMMARY_FILE = "batch_summary.csv"
+
+# wall time, cpu time and memory of all stages are written to this file (the memory is only traced if METRICS_TRACE_MEMORY
+# is true as tracing slows down the script)
+METRICS_FILE = DATA_OUT + "metrics.json"
+METRICS_TRACE_MEMORY = False
+# all errors and warnings of students and teachers are written to this file (".csv" or ".jsonl")
+ERRORS_FILE = DATA_OUT + "errors.csv"
+# similar UNTIS subjects and groups for all deleted groups are written to this file (in the format of MAPPINGS_FILE), only
+# candidates with a similarity of at least SUGGESTION_MIN_SCORE (0 - 1) are suggested
+SUGGESTIONS_FILE = DATA_OUT + "suggested_mappings.json"
+SUGGESTION_COUNT = 3
+SUGGESTION_MIN_SCORE = 0.3
+
+# users, groups, memberships and owners of the import are written to this directory as Parquet files (requires pyarrow)
+WRITE_SNAPSHOT = True
+SNAPSHOT_DIR = DATA_OUT + "snapshot/"
+
+# the source files are checked for missing columns, invalid grades etc. before the import, which stops if there are errors
+VALIDATE_SOURCES = True
+
+# watch mode (--watch): seconds between two checks of the source files and the mappings file
+WATCH_INTERVAL = 1.0
+
+# minimum number of seconds between two progress messages
+PROGRESS_INTERVAL = 1.0
+
+# number of different firstnames whose main names are cached
+MAIN_NAME_CACHE_SIZE = 4096
+
+# number of different grades whose canonical form is cached
+GRADE_CACHE_SIZE = 1024
+
+# number of bytes which are read at once to detect the encoding of a source file
+ENCODING_SNIFF_SIZE = 64 * 1024
+
 CURRENT_DIR = os.path.dirname(__file__)
 
+# errors and warnings: every different error is only stored once with the number of times it occured
 class Errors:
+    fields = ["type", "target", "short", "message"]
 
     def __init__(self):
-        self.errors = []
+        # (type, target, short, message) -> number of occurences, in the order they occured first
+        self.errors = {}
+        self.total = 0
+        # indexes: type / short / target -> keys of the errors
+        self.by_type = collections.defaultdict(list)
+        self.by_short = collections.defaultdict(list)
+        self.by_target = collections.defaultdict(list)
+        # (type, short) -> number of occurences
+        self.summary = collections.Counter()
+        # every added error in order (only if it is set to a list, e.g. in delta mode)
+        self.log = None
 
     def add_error(self, type, student, short, message):
-        self.errors.append({"type": type, "target": student, "short": short, "message": message})
+        key = (type, student, short, message)
+        if(self.log is not None):
+            self.log.append(key)
+        self.total += 1
+        self.summary[(type, short)] += 1
+        if(key in self.errors):
+            self.errors[key] += 1
+            return
+        self.errors[key] = 1
+        self.by_type[type].append(key)
+        self.by_short[short].append(key)
+        self.by_target[student].append(key)
+
+    # all different errors (as dicts with the number of occurences) matching all given values
+    def get(self, type=None, target=None, short=None):
+        candidates = [index[value] for index, value in [(self.by_type, type), (self.by_target, target), (self.by_short, short)] if value is not None]
+        if(len(candidates) == 0):
+            keys = self.errors
+        else:
+            keys = min(candidates, key=len)
+        return [dict(zip(self.fields, key), count=self.errors[key]) for key in keys
+                if (type is None or key[0] == type) and (target is None or key[1] == target) and (short is None or key[2] == short)]
+
+    def get_summary(self):
+        return self.summary
+
+    def __format(self, fields, suppress):
+        lines = ["\t".join(fields)]
+        suppressed = 0
+        for key, count in self.errors.items():
+            if(suppress and key[2] == "duplicate course detected"):
+                suppressed += count
+                continue
+            line = "\t".join(str(key[self.fields.index(field)]) for field in fields)
+            if(count > 1):
+                line += "\t(" + str(count) + " times)"
+            lines.append(line)
+        if(suppressed > 0):
+            lines.append("(" + str(suppressed) + " duplicate course warnings suppressed)")
+        return "\n".join(lines) + "\n"
 
     def __str__(self):
-        output = "type\ttarget\tshort\n"
-        for error in self.errors:
-            if(SUPPRESS_DUPLICATES and error["short"] == "duplicate course detected"):
-                continue
-            output += error["type"] + "\t" + error["target"] + "\t" + error["short"] + "\n"
-        return output
+        return self.__format(["type", "target", "short"], SUPPRESS_DUPLICATES)
 
     def get_errors_verbose(self):
-        output = "type\ttarget\tshort\tmessage\n"
-        for error in self.errors:
-            output += error["type"] + "\t" + error["target"] + "\t" + error["short"] + "\t" + error["message"] + "\n"
-        return output
+        return self.__format(self.fields, False)
 
     def __len__(self):
-        return len(self.errors)
+        return self.total
+
+    # write all errors row by row to the sink (see open_error_sink)
+    def write_to(self, sink, source):
+        for key, count in self.errors.items():
+            sink.write(source, dict(zip(self.fields, key)), count)
+
+# sinks for writing errors to a file while they are read from the stores
+class CsvErrorSink:
+
+    def __init__(self, file):
+        self.file = open(file, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file, delimiter=";")
+        self.writer.writerow(["source"] + Errors.fields + ["count"])
+
+    def write(self, source, error, count):
+        self.writer.writerow([source] + [error[field] for field in Errors.fields] + [count])
+
+    def close(self):
+        self.file.close()
+
+class JsonlErrorSink:
+
+    def __init__(self, file):
+        self.file = open(file, "w", encoding="utf-8")
+
+    def write(self, source, error, count):
+        self.file.write(json.dumps(dict(error, source=source, count=count), ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+# the format depends on the file extension (.jsonl or .csv)
+def open_error_sink(file):
+    os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+    if(file.endswith(".jsonl")):
+        return JsonlErrorSink(file)
+    return CsvErrorSink(file)
 
 def get_file(file):
     return os.path.join(CURRENT_DIR, file)
 
+SEKII_GRADES = ["EF", "Q1", "Q2", "10", "11", "12"]
+
+# SEKII grades: string notation -> number notation
+NUMBER_GRADES = {"EF": "10", "Q1": "11", "Q2": "12"}
+STRING_GRADES = {number: string for string, number in NUMBER_GRADES.items()}
+GRADE_LEVEL_PATTERN = re.compile(r"(\d+)([A-Za-z]*)")
+
+# canonical form of a grade: all notations of a grade (e.g. "EF" and 10) have the same number_name (interned) and level
+class Grade:
+    __slots__ = ["name", "number_name", "string_name", "sekII", "level", "letter", "levels"]
+
+    def __init__(self, name):
+        self.name = name
+        self.number_name = sys.intern(NUMBER_GRADES.get(name, name))
+        self.string_name = STRING_GRADES.get(name, name)
+        self.sekII = name in SEKII_GRADES
+        # e.g. 5a -> 5, "a" and Q1 -> 11, ""
+        match = GRADE_LEVEL_PATTERN.fullmatch(self.number_name)
+        self.level = int(match.group(1)) if match is not None else None
+        self.letter = match.group(2) if match is not None else ""
+        # grades of a group name: a number (05 -> 5) or a range (11-12 -> 11, 12)
+        self.levels = ()
+        try:
+            self.levels = (int(name),)
+        except ValueError:
+            bounds = name.split("-")
+            if(len(bounds) == 2 and all(bound.isdigit() for bound in bounds)):
+                self.levels = tuple(range(int(bounds[0]), int(bounds[1]) + 1))
+
+# grades repeat a lot -> every different grade is only parsed once
+@functools.lru_cache(maxsize=GRADE_CACHE_SIZE)
+def parse_grade(grade):
+    return Grade(str(grade))
+
+# canonical grades of a column (grade: number notation) with the same index
+def get_grade_columns(column):
+    grades = [parse_grade(grade) for grade in column.tolist()]
+    return pandas.DataFrame({"grade": [grade.number_name for grade in grades], "level": [grade.level for grade in grades],
+                             "letter": [grade.letter for grade in grades], "sekII": [grade.sekII for grade in grades]}, index=column.index)
+
 def is_SEKII(grade):
-    return is_same_grade(grade, "EF") or is_same_grade(grade, "Q1") or is_same_grade(grade,"Q2")
+    return parse_grade(grade).sekII
 
 def is_same_grade(grade1, grade2):
-    grade1 = str(grade1)
-    grade2 = str(grade2)
-    if(grade1 == grade2):
-        return True
-    elif((grade1 == "10" and grade2 == "EF") or
-        (grade1 == "EF" and grade2 == "10") or
-        (grade1 == "11" and grade2 == "Q1") or
-        (grade1 == "Q1" and grade2 == "11") or
-        (grade1 == "12" and grade2 == "Q2") or
-        (grade1 == "Q2" and grade2 == "12")):
-        return True
-    return False
+    return parse_grade(grade1).number_name == parse_grade(grade2).number_name
 
 def to_number_grade(grade):
-    if(grade == "EF"):
-        return "10"
-    if(grade == "Q1"):
-        return "11"
-    if(grade == "Q2"):
-        return "12"
-    return grade
+    return parse_grade(grade).number_name
 
 def to_string_grade(grade):
-    if(grade == "10"):
-        return "EF"
-    if(grade == "11"):
-        return "Q1"
-    if(grade == "12"):
-        return "Q2"
-    return grade
+    return parse_grade(grade).string_name
+
+# grade which is the same for all notations of a grade (e.g. "EF" and 10)
+def normalize_grade(grade):
+    return parse_grade(grade).number_name
+
+# SEKI grades (e.g. 5a or 05b) and SEKII grades
+GRADE_PATTERN = re.compile(r"\d{1,2}[A-Za-z]*|EF|Q1|Q2")
+
+# names written in uppercase are main names
+MAIN_NAME_PATTERN = re.compile(r"(?:[^A-Z]+\s|^)([^a-z]+)(?:\s[^a-z]{0,1}[^A-Z]+|$)")
+
+# get the main firstname of a name and whether it has multiple main names (cached because many firstnames repeat)
+@functools.lru_cache(maxsize=MAIN_NAME_CACHE_SIZE)
+def normalize_main_name(name):
+    if(not isinstance(name, str)):
+        return name, False
+    main_names = []
+    multiple = False
+    while True:
+        matches = MAIN_NAME_PATTERN.finditer(name)
+        match = next(matches, None)
+        if(match is None):
+            break
+        if(next(matches, None) is not None):
+            multiple = True
+        main_names.append(match.group(1))
+        name = name.replace(match.group(1), "")
+
+    if(len(main_names) > 0):
+        name = " ".join(main_names)
+    # capitalize all parts of the name (also in double names like "Marie-Luise")
+    return " ".join("-".join(part.capitalize() for part in word.split("-")) for word in name.split(" ")), multiple
+
+# get the main firstnames of a whole column, returns the main names and the positions of all names with multiple main names
+def normalize_main_names(names):
+    results = [normalize_main_name(name) for name in names]
+    return [result[0] for result in results], [position for position, result in enumerate(results) if result[1]]
+
+# umlauts in usernames
+USERNAME_TRANSLATION = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+# only letters, "." and "-" are allowed in usernames
+INVALID_USERNAME_CHARACTERS = re.compile(r"[^A-Za-z.\-]")
+
+# rules of one mapping: keys are exact values, "prefix:<prefix>" or "regex:<regex>" (exact rules are used before the longest
+# prefix and prefixes before the first matching regex)
+class RuleSet:
+
+    # with substitute, the values of prefix rules replace the prefix and the values of regex rules may use groups like \1
+    def __init__(self, rules, substitute=True):
+        self.source = rules
+        self.substitute = substitute
+        self.exact = {}
+        self.prefixes = {}
+        regexes = []
+        for key, value in rules.items():
+            if(key.startswith("prefix:")):
+                self.prefixes[key[len("prefix:"):]] = value
+            elif(key.startswith("regex:")):
+                regexes.append((re.compile(key[len("regex:"):]), value))
+            else:
+                self.exact[key] = value
+        self.prefix_lengths = sorted(set(len(prefix) for prefix in self.prefixes), reverse=True)
+        # every regex is matched on its own, so groups and backreferences of the rules keep their numbers and names
+        self.regexes = regexes
+
+    def __len__(self):
+        return len(self.source)
+
+    # value of the matching rule or the default
+    def get(self, text, default=None):
+        if(text in self.exact):
+            return self.exact[text]
+        for length in self.prefix_lengths:
+            prefix = text[:length]
+            if(prefix in self.prefixes):
+                if(self.substitute):
+                    return self.prefixes[prefix] + text[length:]
+                return self.prefixes[prefix]
+        for regex, value in self.regexes:
+            match = regex.fullmatch(text)
+            if(match is not None):
+                if(self.substitute):
+                    return match.expand(value)
+                return value
+        return default
+
+    # mapped value or the value itself
+    def apply(self, text):
+        return self.get(text, text)
+
+    # replace all values which match a rule
+    def apply_column(self, column):
+        if(len(self.source) == 0):
+            return column
+        if(len(self.exact) == len(self.source)):
+            return column.replace(self.exact)
+        return column.map(lambda value: self.apply(value) if isinstance(value, str) else value)
+
+# the groups of a student or teacher: skip, keep (without checking in UNTIS) or check (after mapping them to UNTIS names)
+class GroupRules:
+
+    def __init__(self, actions, mappings):
+        self.actions = actions
+        self.mappings = mappings
+
+    def apply(self, group):
+        action = self.actions.get(group)
+        if(action is not None):
+            return action, group
+        return "check", self.mappings.apply(group)
+
+# all manual mappings (constants at the top of the file and the rules of MAPPINGS_FILE)
+class MappingRules:
+    tables = {"sekii_course_mappings": "MANUAL_SEKII_COURSE_MAPPINGS", "seki_mappings": "MANUAL_SEKI_MAPPINGS", "untis_search_mappings": "MANUAL_UNTIS_SEARCH_MAPPINGS",
+              "teacher_course_mappings": "MANUAL_TEACHER_COURSE_MAPPINGS", "username_mappings": "MANUAL_USERNAME_MAPPINGS",
+              "teacher_name_mappings": "MANUAL_TEACHER_NAME_MAPPINGS", "teacher_surname_mappings": "MANUAL_TEACHER_SURNAME_MAPPINGS"}
+    lists = {"not_in_untis_exceptions": "NOT_IN_UNTIS_EXCEPTIONS", "skipped_groups": "SKIPPED_GROUPS", "kept_student_groups": "KEPT_STUDENT_GROUPS"}
+
+    def __init__(self, file=None):
+        constants = globals()
+        config = {}
+        if(file is not None and os.path.exists(file)):
+            with open(file, encoding="utf-8") as rules_file:
+                config = json.load(rules_file)
+            for name in config:
+                if(name not in self.tables and name not in self.lists):
+                    raise ValueError("unknown mapping " + name + " in " + file)
+        # the rules of the file are added to (or overwrite) the constants
+        self.source = {}
+        for name, constant in self.tables.items():
+            self.source[name] = dict(constants[constant], **config.get(name, {}))
+        for name, constant in self.lists.items():
+            self.source[name] = list(dict.fromkeys(list(constants[constant]) + config.get(name, [])))
+
+        self.sekII_courses = RuleSet(self.source["sekii_course_mappings"])
+        self.sekI_groups = RuleSet(self.source["seki_mappings"])
+        self.untis_search = RuleSet(self.source["untis_search_mappings"])
+        self.teacher_courses = RuleSet(self.source["teacher_course_mappings"])
+        self.usernames = RuleSet(self.source["username_mappings"])
+        self.teacher_names = RuleSet(self.source["teacher_name_mappings"])
+        self.teacher_surnames = RuleSet(self.source["teacher_surname_mappings"])
+        skipped = {rule: "skip" for rule in self.source["skipped_groups"]}
+        kept = {rule: "keep" for rule in self.source["not_in_untis_exceptions"]}
+        kept_student = {rule: "keep" for rule in self.source["kept_student_groups"]}
+        # a rule in several lists: skipped groups win over kept student groups and the exceptions
+        self.student_groups = GroupRules(RuleSet({**kept, **kept_student, **skipped}, False), self.sekI_groups)
+        self.teacher_groups = GroupRules(RuleSet({**kept, **skipped}, False), self.sekI_groups)
+        self.fingerprint = get_fingerprint(self.source)
+
+# long subjects may have a number at the end which is not important for the search (e.g. F6 -> F)
+def strip_subject_number(subject):
+    if(len(subject) > 2):
+        try:
+            number = int(subject[-1:])
+            return subject[:-1]
+        except ValueError:
+            pass
+    return subject
 
 def array_remove_empties(array):
     result = []
@@ -116,11 +483,967 @@ def array_remove_empties(array):
 def number_to_char(number):
     return chr(64 + int(number))
 
-class Students:
+# SEKII groups of the students by (subject without numbers, grade, LK/GK, teacher), so all variants of a course name
+# (subject numbers, numeric or alphabetic course numbers, PE profiles) of a teacher's course are found with one lookup
+class CourseIndex:
+
+    def __init__(self, groups, mappings):
+        # key -> {(subject, course number): group name}
+        self.courses = {}
+        self.mappings = mappings
+        names = set(groups)
+        # names which are mapped to existing groups are found as well (only possible for exact mappings)
+        for name in names:
+            mapped = mappings.exact.get(name, name)
+            if(mapped in names):
+                self.__add(name, mapped)
+        for name, mapped in mappings.exact.items():
+            if(mapped in names and name not in names):
+                self.__add(name, mapped)
+
+    @staticmethod
+    def get_key(subject, grade, kind, teacher):
+        return (subject.rstrip("0123456789"), grade, kind, teacher)
+
+    def __add(self, name, mapped):
+        parts = name.split("_", 3)
+        if(len(parts) != 4 or parts[2][:2] not in ["LK", "GK"]):
+            return
+        key = self.get_key(parts[0], parts[1], parts[2][:2], parts[3])
+        self.courses.setdefault(key, {})[(parts[0], parts[2][2:])] = mapped
+
+    # all existing groups of the course ordered by rank (rank gets subject and course number and returns None for other courses)
+    def find(self, subject, grade, kind, teacher, rank):
+        variants = self.courses.get(self.get_key(subject, grade, kind, teacher), {})
+        matches = []
+        for variant, name in variants.items():
+            position = rank(*variant)
+            if(position is not None):
+                matches.append((position, name))
+        matches.sort()
+        return [name for position, name in matches]
+
+# lookup structure for UNTIS lessons which is built once and replaces all .loc searches in the UNTIS data
+# one lesson of GPU002, SEKII courses (e.g. "F6 G2") are split when the file is read
+class UntisLesson:
+    __slots__ = ["grade", "teacher", "subject", "sekII", "course", "course_subject", "stem", "subject_number", "course_type", "number", "number_grade"]
+
+    def __init__(self, grade, teacher, subject):
+        self.grade = grade
+        self.teacher = teacher
+        self.subject = subject
+        canonical_grade = parse_grade(grade)
+        self.sekII = canonical_grade.sekII
+        if(not self.sekII):
+            return
+        self.course = array_remove_empties(subject.split(" "))
+        # all subjects should be in uppercase
+        self.course_subject = self.course[0].upper() if len(self.course) > 0 else ""
+        self.course_type = self.course[1][:1] if len(self.course) > 1 else ""
+        self.number = self.course[1][1:] if len(self.course) > 1 else ""
+        self.number_grade = canonical_grade.number_name
+        # numbers at the end of a subject are removed (e.g. F6 -> F, 6)
+        self.stem = self.course_subject
+        self.subject_number = -1
+        try:
+            self.subject_number = int(self.course_subject[-1:])
+            self.stem = self.course_subject[:-1]
+        except ValueError:
+            pass
+
+# class teacher of a grade in GPU003 (type: position of the teacher)
+class ClassTeacher:
+    __slots__ = ["grade", "type", "sekII", "level"]
+
+    def __init__(self, grade, type):
+        self.grade = grade
+        self.type = type
+        canonical_grade = parse_grade(grade)
+        self.sekII = canonical_grade.sekII
+        self.level = canonical_grade.level
+
+class UntisIndex:
+    untis_cols = {"grade": 4, "teacher": 5, "subject": 6, "course": 41}
+
+    def __init__(self, untis_data):
+        self.lesson_count = len(untis_data)
+        # grade -> set of subjects
+        self.grade_subjects = {}
+        # teacher -> list of UntisLessons in UNTIS order (lessons which occur multiple times are the same object)
+        self.teacher_lessons = {}
+        # (teacher, subject) -> list of (position, grade) tuples for prefix searches
+        self.teacher_subject_grades = {}
+        # all subject lengths which occur, so prefix searches only probe existing keys
+        self.subject_lengths = set()
+
+        records = {}
+        lessons = zip(untis_data[self.untis_cols["grade"]].tolist(), untis_data[self.untis_cols["teacher"]].tolist(), untis_data[self.untis_cols["subject"]].tolist())
+        for position, (grade, teacher, subject) in enumerate(lessons):
+            if(not isinstance(subject, str)):
+                # empty subjects can never match
+                continue
+            self.grade_subjects.setdefault(grade, set()).add(subject)
+            lesson = records.get((grade, teacher, subject))
+            if(lesson is None):
+                lesson = records[(grade, teacher, subject)] = UntisLesson(grade, teacher, subject)
+            self.teacher_lessons.setdefault(teacher, []).append(lesson)
+            if(isinstance(grade, str)):
+                self.teacher_subject_grades.setdefault((teacher, subject), []).append((position, grade))
+                self.subject_lengths.add(len(subject))
+        self.subject_lengths = sorted(self.subject_lengths)
+
+    def has_grade(self, grade):
+        return grade in self.grade_subjects
+
+    def has_teacher(self, teacher):
+        return teacher in self.teacher_lessons
+
+    # check if the subject is taught in the grade (exact comparison)
+    def grade_has_subject(self, grade, subject):
+        return subject in self.grade_subjects.get(grade, ())
+
+    # number of lines of the UNTIS file
+    def __len__(self):
+        return self.lesson_count
+
+    # all UntisLessons of a teacher or None if the teacher isn't in UNTIS
+    def get_lessons(self, teacher):
+        return self.teacher_lessons.get(teacher)
+
+    # grades of all lessons of the teacher where the subject starts with the UNTIS subject and the grade starts with grade_prefix
+    def find_grades(self, teacher, subject, grade_prefix):
+        found = []
+        for length in self.subject_lengths:
+            if(length > len(subject)):
+                break
+            for position, grade in self.teacher_subject_grades.get((teacher, subject[:length]), ()):
+                if(grade.startswith(grade_prefix)):
+                    found.append((position, grade))
+        found.sort()
+        return [grade for position, grade in found]
+
+    # check if the teacher has any lesson matching find_grades()
+    def teaches(self, teacher, subject, grade_prefix):
+        for length in self.subject_lengths:
+            if(length > len(subject)):
+                break
+            for position, grade in self.teacher_subject_grades.get((teacher, subject[:length]), ()):
+                if(grade.startswith(grade_prefix)):
+                    return True
+        return False
+
+# joins SchILD students with GOMSTH students and computes the course groups of all GOMSTH students at once
+class GomsthMatcher:
+
+    def __init__(self, gomsth_data, errors, rules=None):
+        self.errors = errors
+        self.rules = rules if rules is not None else MappingRules()
+        # lastname -> positions of the GOMSTH students
+        self.surnames = {}
+        # (lastname, normalized grade, RUFNAME) -> positions of the GOMSTH students
+        self.students = {}
+        keys = zip(gomsth_data.index.tolist(), get_grade_columns(gomsth_data["KLASSE"])["grade"].tolist(), gomsth_data["RUFNAME"].tolist())
+        for position, key in enumerate(keys):
+            self.surnames.setdefault(key[0], []).append(position)
+            self.students.setdefault(key, []).append(position)
+        self.__compute_course_groups(gomsth_data)
+
+    # compute the course groups of all GOMSTH students from the FACH, KURSNR and FACHLEHRERKÜRZEL columns
+    def __compute_course_groups(self, gomsth_data):
+        # wide to long: one row per (student, course slot)
+        courses = []
+        for i in range(1, GOMSTH_MAX_COURSES + 1):
+            columns = ["FACH" + str(i), "KURSNR" + str(i), "FACHLEHRERKÜRZEL" + str(i)]
+            if(not all(column in gomsth_data.columns for column in columns)):
+                continue
+            slot = gomsth_data[columns].astype(object).set_axis(["subject", "number", "teacher"], axis=1)
+            slot.insert(0, "student", range(len(gomsth_data)))
+            slot.insert(1, "slot", i)
+            slot["grade"] = gomsth_data["KLASSE"].astype(str).to_numpy()
+            courses.append(slot.reset_index(drop=True))
+
+        self.course_groups = {}
+        self.outsourced_subjects = {}
+        if(len(courses) == 0):
+            return
+        courses = pandas.concat(courses, ignore_index=True)
+        # there are sometimes empty fields
+        courses = courses[courses["subject"].notna()].sort_values(["student", "slot"], kind="stable")
+
+        subjects = courses["subject"].astype(str)
+        outsourced = subjects.str.lower() == "hb"
+        for student, subject in zip(courses["student"][outsourced], subjects[outsourced]):
+            self.outsourced_subjects.setdefault(student, []).append(subject)
+        courses = courses[~outsourced]
+        subjects = subjects[~outsourced]
+
+        # uppercase subjects are LKs, lowercase subjects GKs
+        course_types = pandas.Series("GK", index=subjects.index).where(subjects.str.upper() != subjects, "LK")
+        numbers = courses["number"].fillna("").astype(str)
+        groups = subjects.str.upper() + "_" + courses["grade"] + "_" + course_types + numbers + "_" + courses["teacher"]
+        # map to other name if required
+        groups = groups.map(self.rules.sekII_courses.apply)
+
+        for student, student_groups in groups.groupby(courses["student"], sort=False):
+            self.course_groups[student] = ";".join(student_groups)
+
+    # find the position of the given student in GOMSTH
+    def find_student(self, first_name, full_name, surname, grade):
+        # search by lastname
+        matches = self.surnames.get(surname)
+        if(matches is None):
+            self.errors.add_error("warning", first_name + " " + surname, "no GOMSTH matches","student has no matches in GOMSTH")
+            return None
+        if(len(matches) == 1):
+            # single match -> already found
+            return matches[0]
+
+        grade = normalize_grade(grade)
+        real_matches = self.students.get((surname, grade, full_name), [])
+        if(len(real_matches) == 0):
+            # sometimes the second name is not in GOMSTH -> only take weak matches into account if there are no strong matches
+            real_matches = self.students.get((surname, grade, first_name), [])
+
+        if(len(real_matches) != 1):
+            # no matching students
+            self.errors.add_error("error", first_name + " " + surname, str(len(real_matches)) + " matches","student has " + str(len(real_matches)) + " matches in GOMSTH")
+
+        if(len(real_matches) > 0):
+            # just return the first match if there are many
+            return real_matches[0]
+        else:
+            return None
+
+    # get GOMSTH groups for a sekII student
+    def get_sekII_groups(self, first_name, full_name, surname, grade):
+        student = self.find_student(first_name, full_name, surname, grade)
+        if(student is None):
+            return ""
+        for subject in self.outsourced_subjects.get(student, []):
+            self.errors.add_error("warning", subject, "outsourced subject", "this subject is outsourced - don't create a group")
+        return self.course_groups.get(student, "")
+
+# account name of a group in iServ (e.g. "Austausch 5a" -> "austausch.5a")
+def get_group_account(group):
+    return group.lower().replace(" ", ".").replace("_", ".")
+
+# collects the owners of all groups (every pair of owner and group is only stored once)
+class GroupOwners:
+    columns = ["nutzer.name", "klasse"]
+
+    def __init__(self):
+        # (username, group) -> None, a dict is used as ordered set
+        self.owners = {}
+
+    def add(self, username, group):
+        self.owners[(username, group)] = None
 
-    untis_cols = {"teacher": 5, "subject": 6, "course": 41}
+    def __len__(self):
+        return len(self.owners)
+
+    # number of groups per owner
+    def get_owner_counts(self):
+        counts = {}
+        for username, group in self.owners:
+            counts[username] = counts.get(username, 0) + 1
+        return counts
+
+    # number of owners per group
+    def get_group_counts(self):
+        counts = {}
+        for username, group in self.owners:
+            counts[group] = counts.get(group, 0) + 1
+        return counts
+
+    def to_dataframe(self):
+        return pandas.DataFrame(list(self.owners), columns=self.columns)
+
+    # stream all pairs to a csv file (same format as DataFrame.to_csv)
+    def write_csv(self, file):
+        with open(file, "w", newline="", encoding="utf-8") as output:
+            writer = csv.writer(output, lineterminator=os.linesep)
+            writer.writerow(self.columns)
+            writer.writerows(self.owners)
+
+# detect the encoding of a file: utf-8 (with or without BOM) or Windows-1252 (as exported by GOMSTH and others)
+def detect_encoding(path):
+    with open(path, "rb") as file:
+        start = file.read(len(codecs.BOM_UTF8))
+        if(start == codecs.BOM_UTF8):
+            return "utf-8-sig"
+        file.seek(0)
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        while True:
+            chunk = file.read(ENCODING_SNIFF_SIZE)
+            if(len(chunk) == 0):
+                # only ascii or valid utf-8 characters
+                return "utf-8"
+            if(chunk.isascii()):
+                continue
+            # the first chunk with other characters decides
+            try:
+                decoder.decode(chunk + file.read(ENCODING_SNIFF_SIZE))
+                return "utf-8"
+            except UnicodeDecodeError:
+                return "cp1252"
+
+# number of fields in the first line of a csv file
+def count_columns(path, encoding, sep):
+    with open(path, encoding=encoding, newline="") as file:
+        return len(next(csv.reader(file, delimiter=sep), []))
+
+# reads every source file only once per run and keeps a persistent cache of the parsed files
+class SourceLoader:
+
+    def __init__(self, cache_dir=None, instrumentation=None):
+        self.cache_dir = cache_dir
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        # (path, options) -> parsed DataFrame (must not be changed by the users of the loader)
+        self.frames = {}
+        self.untis_indexes = {}
+        # encoding and timings of all parsed files
+        self.metrics = []
+        # the loader may be used by multiple threads -> one lock per file
+        self.lock = threading.Lock()
+        self.file_locks = {}
+
+    # get the parsed file, optionally as view with another index (keep: keep the file in memory for other users)
+    def read_csv(self, file, index_col=None, keep=True, **options):
+        key = (os.path.abspath(file), repr(sorted(options.items())))
+        with self.__get_lock(key):
+            frame = self.frames.get(key)
+            if(frame is None):
+                with self.instrumentation.stage("read " + os.path.basename(file)):
+                    frame = self.__read_cached(key[0], key[1], options)
+                if(keep):
+                    self.frames[key] = frame
+        if(index_col is not None):
+            frame = frame.set_index(index_col)
+        return frame
+
+    # UNTIS index of the file which is shared by students and teachers (only the index is kept in memory)
+    def get_untis_index(self, file):
+        path = os.path.abspath(file)
+        with self.__get_lock(("untis index", path)):
+            if(path not in self.untis_indexes):
+                frame = self.read_csv(file, keep=False, **SOURCE_OPTIONS["untis"])
+                with self.instrumentation.stage("index " + os.path.basename(file)):
+                    self.untis_indexes[path] = UntisIndex(frame)
+        return self.untis_indexes[path]
+
+    def __get_lock(self, key):
+        with self.lock:
+            return self.file_locks.setdefault(key, threading.Lock())
+
+    # forget a file, so it's parsed again the next time (e.g. after it has changed)
+    def forget(self, file):
+        path = os.path.abspath(file)
+        for key in [key for key in self.frames if key[0] == path]:
+            del self.frames[key]
+        self.untis_indexes.pop(path, None)
+
+    # parse the file and transcode it on the fly (without writing a converted copy)
+    def __parse(self, path, options):
+        start = time.perf_counter()
+        encoding = detect_encoding(path)
+        detected = time.perf_counter()
+        options = dict(options)
+        columns = options.pop("columns", None)
+        categories = options.pop("categories", [])
+        if(columns is not None and options.get("header", "infer") is None):
+            # files without header: the columns are numbers, only the ones in the first line can be read
+            column_count = count_columns(path, encoding, options.get("sep", ","))
+            options["usecols"] = [column for column in sorted(columns) if column < column_count]
+        elif(columns is not None):
+            columns = set(columns)
+            # missing columns are ignored (unlike with a list of columns)
+            options["usecols"] = lambda column: column in columns
+        if(options.get("header", "infer") is not None and len(categories) > 0):
+            # named columns can be parsed as categorical directly
+            dtype = options.get("dtype")
+            options["dtype"] = {column: "category" for column in categories}
+            if(dtype is not None):
+                options["dtype"] = collections.defaultdict(lambda: dtype, options["dtype"])
+            categories = []
+        with open(path, "rb") as raw_file:
+            with io.TextIOWrapper(raw_file, encoding=encoding, newline="") as file:
+                frame = pandas.read_csv(file, **options)
+        for column in categories:
+            if(column in frame.columns):
+                frame[column] = frame[column].astype("category")
+        parsed = time.perf_counter()
+        self.metrics.append({"file": path, "encoding": encoding, "cached": False, "detection_time": detected - start, "parse_time": parsed - detected})
+        if(encoding != "utf-8"):
+            print("Transcoded", os.path.basename(path), "from", encoding, "to utf-8.")
+        return frame
+
+    def __read_cached(self, path, options_key, options):
+        if(self.cache_dir is None):
+            return self.__parse(path, options)
+
+        # cache files are named <hash of path and options>-<hash of size, mtime and content>
+        stat = os.stat(path)
+        with open(path, "rb") as file:
+            content_hash = hashlib.sha256(file.read()).hexdigest()
+        prefix = hashlib.sha256((path + "\n" + options_key).encode("utf-8")).hexdigest()[:32]
+        version = hashlib.sha256((str(stat.st_size) + "\n" + str(stat.st_mtime_ns) + "\n" + content_hash).encode("utf-8")).hexdigest()[:32]
+        cache_file = os.path.join(self.cache_dir, prefix + "-" + version + ".pickle")
+
+        if(os.path.exists(cache_file)):
+            try:
+                start = time.perf_counter()
+                frame = pandas.read_pickle(cache_file)
+                self.metrics.append({"file": path, "encoding": None, "cached": True, "detection_time": 0.0, "parse_time": time.perf_counter() - start})
+                return frame
+            except Exception:
+                # broken cache files are just parsed again
+                pass
+
+        frame = self.__parse(path, options)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for old_file in os.listdir(self.cache_dir):
+            if(old_file.startswith(prefix + "-")):
+                os.remove(os.path.join(self.cache_dir, old_file))
+        frame.to_pickle(cache_file)
+        return frame
+
+# size and modification time of a file or None if it doesn't exist
+def get_file_version(file):
+    try:
+        stat = os.stat(file)
+        return (stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        return None
+
+# checks the source files in one pass before they are parsed: required columns, number of columns, grades and unique keys
+# -> broken files are reported at once instead of failing somewhere while formatting
+class SourceValidator:
+    # number of line numbers listed per problem
+    max_lines = 10
 
-    def __init__(self, schild_file, gomsth_file, untis_file, output_file, verbose=False):
+    def __init__(self):
+        # path -> (version, problems) of all validated files, so unchanged files aren't read again (watch mode)
+        self.results = {}
+        self.validators = {"schild_sus": self.__validate_schild_sus, "schild_lul": self.__validate_schild_lul, "gomsth": self.__validate_gomsth,
+                           "untis": self.__validate_untis, "class_teachers": self.__validate_class_teachers}
+
+    # adds all problems of the file to errors (target: name of the file)
+    def validate(self, file, kind, errors):
+        path = os.path.abspath(file)
+        version = get_file_version(path)
+        if(path not in self.results or self.results[path][0] != version):
+            # (type, short, message) -> line numbers
+            problems = {}
+            if(version is None):
+                problems[("error", "missing file", "file doesn't exist")] = []
+            else:
+                with open(path, encoding=detect_encoding(path), newline="") as source:
+                    self.validators[kind](source, problems)
+            self.results[path] = (version, problems)
+        for (type, short, message), lines in self.results[path][1].items():
+            if(len(lines) > 0):
+                message += " (line " + ", ".join(str(line) for line in lines[:self.max_lines])
+                if(len(lines) > self.max_lines):
+                    message += " and " + str(len(lines) - self.max_lines) + " more"
+                message += ")"
+            errors.add_error(type, os.path.basename(path), short, message)
+
+    def __add(self, problems, type, short, message, line=None):
+        lines = problems.setdefault((type, short, message), [])
+        if(line is not None):
+            lines.append(line)
+
+    # rows of a file with header as (line, row) tuples, the header is checked for the required columns
+    def __read_rows(self, source, sep, required, problems):
+        reader = csv.reader(source, delimiter=sep)
+        header = next(reader, None)
+        if(header is None):
+            self.__add(problems, "error", "empty file", "file is empty")
+            return {}, []
+        columns = {}
+        for position, column in enumerate(header):
+            if(column in columns):
+                self.__add(problems, "error", "duplicate column", "column " + column + " exists more than once", 1)
+            columns.setdefault(column, position)
+        for column in required:
+            if(column not in columns):
+                self.__add(problems, "error", "missing column", "required column " + column + " is missing", 1)
+        return columns, self.__check_lengths(enumerate(reader, 2), len(header), problems)
+
+    # skips empty lines, lines with more fields than the first line can't be parsed
+    def __check_lengths(self, rows, length, problems, warn_short=True):
+        for line, row in rows:
+            if(len(row) == 0):
+                continue
+            if(len(row) > length):
+                self.__add(problems, "error", "too many columns", "more than " + str(length) + " columns", line)
+            elif(warn_short and len(row) < length):
+                self.__add(problems, "warning", "too few columns", "less than " + str(length) + " columns", line)
+            yield line, row
+
+    def __get(self, row, columns, column):
+        position = columns.get(column)
+        if(position is None or position >= len(row)):
+            return ""
+        return row[position]
+
+    # seen: set of all keys so far, name: name of the key in the message
+    def __check_unique(self, seen, key, line, type, name, problems):
+        if(key in seen):
+            self.__add(problems, type, "duplicate key", name + " occurs more than once", line)
+        else:
+            seen.add(key)
+
+    def __validate_schild_sus(self, source, problems):
+        required = ["Vorname", "Nachname", "Klasse", "Import-ID", "Gruppen"]
+        columns, rows = self.__read_rows(source, SOURCE_OPTIONS["schild"]["sep"], required, problems)
+        ids = set()
+        for line, row in rows:
+            grade = self.__get(row, columns, "Klasse")
+            if("Klasse" not in columns):
+                pass
+            elif(grade == ""):
+                self.__add(problems, "error", "missing grade", "student without grade", line)
+            elif(GRADE_PATTERN.fullmatch(grade) is None):
+                self.__add(problems, "warning", "invalid grade", "grade " + grade + " has an unknown format", line)
+            import_id = self.__get(row, columns, "Import-ID")
+            if("Import-ID" not in columns):
+                pass
+            elif(import_id == ""):
+                self.__add(problems, "error", "missing key", "student without Import-ID", line)
+            else:
+                self.__check_unique(ids, import_id, line, "error", "Import-ID", problems)
+
+    def __validate_schild_lul(self, source, problems):
+        required = ["Vorname", "Nachname", "Information", "ID", "Gruppen"]
+        columns, rows = self.__read_rows(source, SOURCE_OPTIONS["schild"]["sep"], required, problems)
+        ids = set()
+        teachers = set()
+        for line, row in rows:
+            teacher_id = self.__get(row, columns, "ID")
+            if("ID" not in columns):
+                pass
+            elif(teacher_id == ""):
+                self.__add(problems, "error", "missing key", "teacher without ID", line)
+            else:
+                self.__check_unique(ids, teacher_id, line, "error", "ID", problems)
+            teacher = self.__get(row, columns, "Information")
+            if("Information" not in columns):
+                pass
+            elif(teacher == ""):
+                self.__add(problems, "warning", "missing teacher", "teacher without UNTIS abbreviation (Information)", line)
+            else:
+                self.__check_unique(teachers, teacher, line, "warning", "UNTIS abbreviation", problems)
+
+    def __validate_gomsth(self, source, problems):
+        columns, rows = self.__read_rows(source, SOURCE_OPTIONS["gomsth"]["sep"], ["FAMILIENNAME", "RUFNAME", "KLASSE"], problems)
+        slots = 0
+        for i in range(1, GOMSTH_MAX_COURSES + 1):
+            found = [column + str(i) in columns for column in ["FACH", "KURSNR", "FACHLEHRERKÜRZEL"]]
+            if(all(found)):
+                slots += 1
+            elif(any(found)):
+                self.__add(problems, "warning", "incomplete course columns", "course " + str(i) + " is ignored as FACH, KURSNR or FACHLEHRERKÜRZEL is missing", 1)
+        if(len(columns) > 0 and slots == 0):
+            self.__add(problems, "error", "missing column", "no complete course columns (FACH1, KURSNR1, FACHLEHRERKÜRZEL1, ...)", 1)
+        students = set()
+        has_key = all(column in columns for column in ["FAMILIENNAME", "RUFNAME", "KLASSE"])
+        for line, row in rows:
+            grade = self.__get(row, columns, "KLASSE")
+            if("KLASSE" not in columns):
+                pass
+            elif(grade == ""):
+                self.__add(problems, "warning", "missing grade", "student without grade", line)
+            elif(not is_SEKII(grade)):
+                self.__add(problems, "warning", "invalid grade", "grade " + grade + " isn't a SEKII grade", line)
+            if(has_key):
+                key = (self.__get(row, columns, "FAMILIENNAME"), self.__get(row, columns, "RUFNAME"), normalize_grade(grade))
+                self.__check_unique(students, key, line, "warning", "student (FAMILIENNAME, RUFNAME and KLASSE)", problems)
+
+    def __validate_untis(self, source, problems):
+        reader = csv.reader(source, delimiter=SOURCE_OPTIONS["untis"]["sep"])
+        first = next(reader, None)
+        if(first is None):
+            self.__add(problems, "error", "empty file", "file is empty")
+            return
+        # the number of columns is determined by the first line
+        required = max(UntisIndex.untis_cols["grade"], UntisIndex.untis_cols["teacher"], UntisIndex.untis_cols["subject"]) + 1
+        for line, row in self.__check_lengths(itertools.chain([(1, first)], enumerate(reader, 2)), len(first), problems, False):
+            if(len(row) < required):
+                self.__add(problems, "error", "too few columns", "less than " + str(required) + " columns (grade, teacher and subject are missing)", line)
+                continue
+            grade = row[UntisIndex.untis_cols["grade"]]
+            if(grade != "" and GRADE_PATTERN.fullmatch(grade) is None):
+                self.__add(problems, "warning", "invalid grade", "grade " + grade + " has an unknown format", line)
+
+    def __validate_class_teachers(self, source, problems):
+        reader = csv.reader(source, delimiter=SOURCE_OPTIONS["class_teachers"]["sep"])
+        grades = set()
+        for line, row in enumerate(reader, 1):
+            if(len(row) == 0):
+                continue
+            if(len(row) < 2 or row[1] == ""):
+                self.__add(problems, "error", "too few columns", "the second column with grade and class teachers is missing", line)
+                continue
+            data = row[1].split(" ")
+            if(len(data) < 2):
+                self.__add(problems, "warning", "missing class teachers", "grade " + data[0] + " has no class teachers", line)
+            self.__check_unique(grades, data[0], line, "warning", "grade", problems)
+
+# source files of the import: (constant, kind of the file for the SourceValidator)
+SOURCE_FILES = [("SCHILD_SUS_FILE", "schild_sus"), ("GOMSTH_SUS_FILE", "gomsth"), ("UNTIS_LUL_FILE", "untis"), ("SCHILD_LUL_FILE", "schild_lul"), ("CLASS_TEACHERS_FILE", "class_teachers")]
+
+def validate_sources(validator=None):
+    validator = validator if validator is not None else SourceValidator()
+    errors = Errors()
+    for constant, kind in SOURCE_FILES:
+        validator.validate(get_file(globals()[constant]), kind, errors)
+    return errors
+
+def print_validation(errors):
+    error_count = len(errors.get(type="error"))
+    print("Found", error_count, "errors and", len(errors.get(type="warning")), "warnings in the source files.")
+    if(len(errors) > 0):
+        print(errors.get_errors_verbose())
+    return error_count
+
+# runs phases in threads as soon as all phases they depend on are finished
+class PhaseScheduler:
+
+    def __init__(self, threads=SCHEDULER_THREADS):
+        self.threads = threads
+        # name -> (function, dependencies) in the order they were added
+        self.phases = {}
+        # name -> (start, end) relative to the start of run()
+        self.timings = {}
+
+    def add(self, name, function, dependencies=[]):
+        for dependency in dependencies:
+            if(dependency not in self.phases):
+                raise ValueError("unknown phase " + dependency + " (phases have to be added after their dependencies)")
+        self.phases[name] = (function, list(dependencies))
+
+    def run(self):
+        start = time.perf_counter()
+        waiting = list(self.phases)
+        running = {}
+        finished = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as executor:
+            while(len(waiting) > 0 or len(running) > 0):
+                # start all phases whose dependencies are finished
+                for name in [name for name in waiting if all(dependency in finished for dependency in self.phases[name][1])]:
+                    waiting.remove(name)
+                    running[executor.submit(self.__run_phase, name, start)] = name
+                done, pending = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    finished.add(running.pop(future))
+                    if(future.exception() is not None):
+                        # don't start any other phase, wait for the running ones and stop
+                        concurrent.futures.wait(running)
+                        raise future.exception()
+
+    def __run_phase(self, name, start):
+        phase_start = time.perf_counter() - start
+        try:
+            self.phases[name][0]()
+        finally:
+            self.timings[name] = (phase_start, time.perf_counter() - start)
+
+    # the chain of phases which determined the total time (the dependency which finished last is followed)
+    def get_critical_path(self):
+        if(len(self.timings) == 0):
+            return []
+        path = [max(self.timings, key=lambda name: self.timings[name][1])]
+        while True:
+            dependencies = [dependency for dependency in self.phases[path[0]][1] if dependency in self.timings]
+            if(len(dependencies) == 0):
+                return path
+            path.insert(0, max(dependencies, key=lambda name: self.timings[name][1]))
+
+    def print_summary(self):
+        print("phase\tstart\tend\twall time")
+        for name in self.phases:
+            if(name in self.timings):
+                phase_start, phase_end = self.timings[name]
+                print(name + "\t" + format(phase_start, ".3f") + "\t" + format(phase_end, ".3f") + "\t" + format(phase_end - phase_start, ".3f") + " s")
+        path = self.get_critical_path()
+        if(len(path) > 0):
+            print("critical path:", " -> ".join(path), "(" + format(self.timings[path[-1]][1], ".3f"), "s)")
+
+# number of records per latency in buckets of powers of two microseconds
+class LatencyHistogram:
+    buckets = 25
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[min(int(seconds * 1000000).bit_length(), self.buckets - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if(self.min is None or seconds < self.min):
+            self.min = seconds
+        if(seconds > self.max):
+            self.max = seconds
+
+    # upper bound of the bucket containing the percentile
+    def get_percentile(self, percentile):
+        needed = percentile / 100 * self.count
+        found = 0
+        for bucket, count in enumerate(self.counts):
+            found += count
+            if(found >= needed and found > 0):
+                return min((2 ** bucket) / 1000000, self.max)
+        return 0.0
+
+    def to_dict(self):
+        return {"count": self.count, "total": self.total, "mean": self.total / self.count if self.count > 0 else 0.0, "min": self.min or 0.0, "max": self.max,
+                "p50": self.get_percentile(50), "p90": self.get_percentile(90), "p99": self.get_percentile(99),
+                "buckets": [{"le_us": 2 ** bucket, "count": count} for bucket, count in enumerate(self.counts) if count > 0]}
+
+# records wall time, cpu time and memory of the stages and the latencies of single records
+class Instrumentation:
+
+    def __init__(self, trace_memory=False):
+        self.lock = threading.Lock()
+        # name -> totals of all calls of the stage
+        self.stages = {}
+        self.histograms = {}
+        self.trace_memory = trace_memory
+        if(trace_memory and not tracemalloc.is_tracing()):
+            tracemalloc.start()
+
+    # a stage may be entered multiple times (e.g. once per student), the times are added up
+    @contextlib.contextmanager
+    def stage(self, name):
+        if(self.trace_memory):
+            start_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start
+            cpu_time = time.thread_time() - cpu_start
+            # the peak of the whole process while the stage was running (higher if other stages run at the same time)
+            peak_memory = tracemalloc.get_traced_memory()[1] - start_memory if self.trace_memory else None
+            with self.lock:
+                stage = self.stages.setdefault(name, {"calls": 0, "wall_time": 0.0, "cpu_time": 0.0, "peak_memory": None, "max_rss": None})
+                stage["calls"] += 1
+                stage["wall_time"] += wall_time
+                stage["cpu_time"] += cpu_time
+                if(peak_memory is not None):
+                    stage["peak_memory"] = max(stage["peak_memory"] or 0, peak_memory)
+                stage["max_rss"] = get_max_rss()
+
+    # the histogram must only be used by one thread
+    def get_histogram(self, name):
+        with self.lock:
+            return self.histograms.setdefault(name, LatencyHistogram())
+
+    # call the function for every record (row of the columns) and record the latencies
+    def map(self, name, function, *columns):
+        histogram = self.get_histogram(name)
+        results = []
+        with self.stage(name):
+            for record in zip(*columns):
+                start = time.perf_counter()
+                results.append(function(*record))
+                histogram.add(time.perf_counter() - start)
+        return results
+
+    def print_summary(self):
+        print("stage\tcalls\twall time\tcpu time\tpeak memory")
+        for name, stage in self.stages.items():
+            peak_memory = "-" if stage["peak_memory"] is None else format(stage["peak_memory"] / 1024 / 1024, ".1f") + " MB"
+            print(name + "\t" + str(stage["calls"]) + "\t" + format(stage["wall_time"], ".3f") + " s\t" + format(stage["cpu_time"], ".3f") + " s\t" + peak_memory)
+        for name, histogram in self.histograms.items():
+            print(name + ":", histogram.count, "records, p50", format(histogram.get_percentile(50) * 1000, ".3f"), "ms, p99", format(histogram.get_percentile(99) * 1000, ".3f"), "ms, max", format(histogram.max * 1000, ".3f"), "ms")
+
+    def write_json(self, file, **sections):
+        os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+        metrics = {"stages": self.stages, "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()}}
+        metrics.update(sections)
+        with open(file, "w", encoding="utf-8") as metrics_file:
+            json.dump(metrics, metrics_file, indent=1)
+
+# highest memory usage of the process so far in bytes (None if unknown)
+def get_max_rss():
+    if(resource is None):
+        return None
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# prints the progress of a loop at most every PROGRESS_INTERVAL seconds and when it's finished
+class ProgressReporter:
+
+    def __init__(self, label, total, interval=None):
+        self.label = label
+        self.total = total
+        self.interval = interval if interval is not None else PROGRESS_INTERVAL
+        self.done = 0
+        self.last_print = time.perf_counter()
+
+    def update(self, count=1):
+        self.done += count
+        now = time.perf_counter()
+        if(self.done >= self.total or now - self.last_print >= self.interval):
+            self.last_print = now
+            percent = 100 if self.total == 0 else int(self.done / self.total * 100)
+            print(self.label + ":", percent, "% (" + str(self.done), "of", str(self.total) + ")")
+
+# value as written by DataFrame.to_csv (numpy scalars -> python scalars, missing values -> "")
+def to_csv_value(value):
+    if(pandas.isna(value)):
+        return ""
+    if(hasattr(value, "item")):
+        return value.item()
+    return value
+
+# writes rows to an iServ csv file in a background thread, so writing overlaps with formatting
+class StreamingCsvWriter:
+
+    def __init__(self, file, columns, chunk_size=None):
+        self.file = file
+        self.chunk_size = chunk_size if chunk_size is not None else STREAM_CHUNK_SIZE
+        self.buffer = []
+        self.written_rows = 0
+        self.error = None
+        # limit the number of waiting chunks, so memory doesn't grow if writing is slower than formatting
+        self.chunks = queue.Queue(maxsize=4)
+        self.thread = threading.Thread(target=self.__write, args=(list(columns),), daemon=True)
+        self.thread.start()
+
+    def write_row(self, row):
+        self.buffer.append(row)
+        if(len(self.buffer) >= self.chunk_size):
+            self.__flush()
+
+    def write_rows(self, rows):
+        self.__flush()
+        self.chunks.put(list(rows))
+
+    # write all remaining rows and wait for the writing thread
+    def close(self):
+        self.__flush()
+        self.chunks.put(None)
+        self.thread.join()
+        if(self.error is not None):
+            raise self.error
+
+    def __flush(self):
+        if(len(self.buffer) > 0):
+            self.chunks.put(self.buffer)
+            self.buffer = []
+
+    def __write(self, columns):
+        try:
+            with open(self.file, "w", newline="", encoding="utf-8") as output:
+                # same format as DataFrame.to_csv(sep=";", quoting=csv.QUOTE_NONNUMERIC)
+                writer = csv.writer(output, delimiter=";", quoting=csv.QUOTE_NONNUMERIC, lineterminator=os.linesep)
+                writer.writerow(columns)
+                while True:
+                    rows = self.chunks.get()
+                    if(rows is None):
+                        break
+                    writer.writerows([to_csv_value(value) for value in row] for row in rows)
+                    self.written_rows += len(rows)
+        except Exception as error:
+            self.error = error
+            # keep consuming, so the formatting thread isn't blocked
+            while(self.chunks.get() is not None):
+                pass
+
+# hash of json serializable values (used to detect changed inputs)
+def get_fingerprint(values):
+    return hashlib.sha1(json.dumps(values, default=str, sort_keys=True).encode("utf-8")).hexdigest()
+
+# row values which can be stored as json and compared afterwards (NaN -> None)
+def to_json_row(row):
+    return [None if (isinstance(value, float) and value != value) else value for value in row]
+
+# unique key for each record (duplicate ids get a running number)
+def get_record_keys(ids):
+    keys = []
+    counts = {}
+    for record_id in ids:
+        key = str(record_id)
+        counts[key] = counts.get(key, 0) + 1
+        if(counts[key] > 1):
+            key += "#" + str(counts[key])
+        keys.append(key)
+    return keys
+
+# stores the inputs and results of each record of the last run to be able to only recompute changed records
+class DeltaState:
+    # states of other versions (e.g. without the errors or the owned groups of the records) are ignored
+    version = 3
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.previous = {}
+        self.current = {}
+        if(os.path.exists(state_file)):
+            with open(state_file, "r", encoding="utf-8") as file:
+                self.previous = json.load(file)
+            if(self.previous.get("version") != self.version):
+                print("Delta state of another version found - computing everything.")
+                self.previous = {}
+            else:
+                print("Loaded delta state of the last run.")
+        else:
+            print("No delta state found - computing everything.")
+
+    # records (key -> dict) of the last run
+    def get_previous(self, section):
+        return self.previous.get(section, {})
+
+    def set_current(self, section, records):
+        self.current[section] = records
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        with open(self.state_file, "w", encoding="utf-8") as file:
+            json.dump(dict(self.current, version=self.version), file)
+
+    # write the rows which were added, changed or removed since the last run
+    def write_delta_files(self, section, data, output_file, **csv_options):
+        previous = self.get_previous(section)
+        current = self.current.get(section, {})
+        keys = list(current)
+        added = [key not in previous for key in keys]
+        changed = [key in previous and previous[key]["row"] != current[key]["row"] for key in keys]
+        removed = [previous[key]["row"] for key in previous if key not in current]
+
+        data[added].to_csv(get_delta_file(output_file, "added"), **csv_options)
+        data[changed].to_csv(get_delta_file(output_file, "changed"), **csv_options)
+        pandas.DataFrame(removed, columns=data.columns).to_csv(get_delta_file(output_file, "removed"), **csv_options)
+        print("Delta:", sum(added), "added,", sum(changed), "changed and", len(removed), "removed.")
+
+    # write the pairs which were added or removed since the last run
+    def write_delta_pairs(self, section, pairs, columns, output_file):
+        previous = [tuple(pair) for pair in self.previous.get(section, [])]
+        self.current[section] = [list(pair) for pair in pairs]
+        previous_set = set(previous)
+        current_set = set(pairs)
+        added = [pair for pair in pairs if pair not in previous_set]
+        removed = [pair for pair in previous if pair not in current_set]
+        pandas.DataFrame(added, columns=columns).to_csv(get_delta_file(output_file, "added"), sep=",", index=False)
+        pandas.DataFrame(removed, columns=columns).to_csv(get_delta_file(output_file, "removed"), sep=",", index=False)
+        print("Delta:", len(added), "added and", len(removed), "removed.")
+
+def get_delta_file(output_file, kind):
+    root, extension = os.path.splitext(output_file)
+    return root + " " + kind + extension
+
+class Students:
+
+    def __init__(self, schild_file, gomsth_file, untis_file, output_file, verbose=False, engine="vectorized", loader=None, delta=None, stream=False, instrumentation=None, rules=None):
         self.schild_file = schild_file
         self.gomsth_file = gomsth_file
         self.untis_file = untis_file
@@ -129,31 +1452,40 @@ class Students:
         # array with all groups for controlling purposes
         self.control_groups = []
         self.deleted_groups = []
+        # errors and deleted groups of every formatted student by position (only in delta mode)
+        self.record_extras = None
         self.verbose = verbose
-
-    # get the main firstname
-    def __find_main_names(self, name):
-        main_name = []
-        while True:
-            new_main_name = re.findall(r"(?:[^A-Z]+\s|^)([^a-z]+)(?:\s[^a-z]{0,1}[^A-Z]+|$)", name)
-            if(len(new_main_name) == 0):
-                if(len(main_name) == 0):
-                    name = name
-                else:
-                    name = " ".join(main_name)
-                names = name.split(" ")
-                final_name = ""
-                for i in range(len(names)):
-                    part_names = names[i].split("-")
-                    part_final_name = ""
-                    for i2 in range(len(part_names)):
-                        part_final_name += part_names[i2].capitalize() + "-"
-                    final_name += part_final_name[:-1] + " "
-                return final_name[:-1]
-            if(len(new_main_name) > 1):
-                self.errors.add_error("warning", students["Vorname"][i] + " " + students["Nachname"][i], "multiple main names", "student has multiple main names - concatenating all")
-            main_name.append(new_main_name[0])
-            name = name.replace(new_main_name[0], "")
+        self.engine = engine
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.loader = loader if loader is not None else SourceLoader(instrumentation=self.instrumentation)
+        self.rules = rules if rules is not None else MappingRules()
+        self.delta = delta
+        self.stream = stream and delta is None
+        self.writer = None
+
+    # call function for the student at position and remember the errors and deleted groups it caused (delta mode)
+    def __track(self, position, function, *args):
+        if(self.record_extras is None):
+            return function(*args)
+        errors = len(self.errors.log)
+        deleted_groups = len(self.deleted_groups)
+        result = function(*args)
+        self.record_extras[position]["errors"].extend(self.errors.log[errors:])
+        self.record_extras[position]["deleted_groups"].extend(self.deleted_groups[deleted_groups:])
+        return result
+
+    # map function over the columns of the students at positions
+    def __map(self, name, function, positions, *columns):
+        if(self.record_extras is None):
+            return self.instrumentation.map(name, function, *columns)
+        return self.instrumentation.map(name, lambda position, *values: self.__track(position, function, *values), positions, *columns)
+
+    # get the main firstnames of all students (at positions) and log students with multiple main names
+    def __find_main_names(self, full_names, surnames, positions):
+        main_names, multiple_main_names = normalize_main_names(full_names)
+        for position in multiple_main_names:
+            self.__track(positions[position], self.errors.add_error, "warning", str(full_names[position]) + " " + str(surnames[position]), "multiple main names", "student has multiple main names - concatenating all")
+        return main_names
 
     # get exchange groups for grades
     def __add_course_groups(self, groups, grade):
@@ -164,85 +1496,9 @@ class Students:
         else:
             return groups + ";Austausch " + grade
 
-    # find given student in GOMSTH
-    def __find_gomsth_student(self, student):
-        try:
-            # search by lastname
-            matches = self.gomsth_data.loc[student["Nachname"]]
-        except(KeyError):
-            self.errors.add_error("warning", student["Vorname"] + " " + student["Nachname"], "no GOMSTH matches","student has no matches in GOMSTH")
-            return None
-
-        if(isinstance(matches, pandas.core.series.Series)):
-            # single match -> already found
-            return matches
-        real_matches = []
-        weak_matches = []
-        for i in range(len(matches)):
-            match = matches.iloc[i]
-            # check for each match if it's the right firstname and grade
-            if(match["RUFNAME"] == student["full_name"] and is_same_grade(match["KLASSE"], student["Klasse"])):
-                real_matches.append(match)
-            elif(match["RUFNAME"] == student["Vorname"] and is_same_grade(match["KLASSE"], student["Klasse"])):
-                #sometimes the second name is not in GOMSTH
-                weak_matches.append(match)
-
-        if(len(real_matches) == 0 and len(weak_matches) > 0):
-            # only take weak matches into account if there are no strong matches
-            real_matches = weak_matches
-
-        if(len(real_matches) != 1):
-            # no matching students
-            self.errors.add_error("error", student["Vorname"] + " " + student["Nachname"], str(len(real_matches)) + " matches","student has " + str(len(real_matches)) + " matches in GOMSTH")
-            
-        if(len(real_matches) > 0):
-            # just return the first match if there are many
-            return real_matches[0]
-        else:
-            return None
-
-    # compute proper course name for a given course
-    def __get_course_group_name(self, subject, number, teacher, grade):
-        if(isinstance(number, float)):
-            number = str(int(number))
-        
-        number = str(number)
-
-        if(subject.lower() == "hb"):
-            self.errors.add_error("warning", subject, "outsourced subject", "this subject is outsourced - don't create a group")
-            return ""
-        group = ""
-        if(subject.upper() == subject):
-            #LK
-            group = subject.upper() + "_" + str(grade) + "_" + "LK" + number + "_" + teacher
-        else:
-            #GK
-            group = subject.upper() + "_" + str(grade) + "_" + "GK" + number + "_" + teacher
-
-        # map to other name if required
-        if(group in MANUAL_SEKII_COURSE_MAPPINGS):
-            group = MANUAL_SEKII_COURSE_MAPPINGS[group]
-
-        return group
-
     # get GOMSTH groups for sekII students
     def __get_sekII_groups(self, student):
-        gomsth_student = self.__find_gomsth_student(student)
-        if(gomsth_student is None):
-            return ""
-        
-        courses = ""
-        for i in range(1, GOMSTH_MAX_COURSES + 1):
-            try:
-                if(pandas.isna(gomsth_student["FACH" + str(i)])):
-                    #there are sometimes empty fields
-                    continue
-                course = self.__get_course_group_name(gomsth_student["FACH" + str(i)], gomsth_student["KURSNR" + str(i)], gomsth_student["FACHLEHRERKÜRZEL" + str(i)], gomsth_student["KLASSE"])
-                if(len(course) > 0):
-                    courses += course + ";"
-            except KeyError:
-                continue
-        return courses[:-1]
+        return self.gomsth_matcher.get_sekII_groups(student["Vorname"], student["full_name"], student["Nachname"], student["Klasse"])
 
     # add all groups to control groups
     def __add_control_groups(self, groups):
@@ -253,55 +1509,30 @@ class Students:
     def __check_sekI_groups(self, grade, groups):
         edited_groups = ""
         for group in groups.split(";"):
-            if(group.startswith("Fuellsel")):
+            # manual mappings from SchILD style to UNTIS style
+            action, group = self.rules.student_groups.apply(group)
+            if(action == "skip"):
                 continue
-            if(group.startswith("Austausch") or (group in NOT_IN_UNTIS_EXCEPTIONS)):
+            if(action == "keep"):
                 # exchange groups and manual exceptions are just added
                 edited_groups += group + ";"
             else:
-                # manual mappings from SchILD style to UNTIS style
-                if(group in MANUAL_SEKI_MAPPINGS):
-                    group = MANUAL_SEKI_MAPPINGS[group]
                 splitted_group = group.split(" ")
-                subject = splitted_group[0]
-                if(len(subject) > 2):
-                    # unusually long subject
-                    try:
-                        # maybe there is a number at the end which is not important
-                        number = int(subject[-1:])
-                        subject = subject[:-1]
-                    except ValueError:
-                        pass
+                # maybe there is a number at the end of an unusually long subject which is not important
+                subject = strip_subject_number(splitted_group[0])
 
                 # map for search
-                if(subject in MANUAL_UNTIS_SEARCH_MAPPINGS):
-                    subject = MANUAL_UNTIS_SEARCH_MAPPINGS[subject]
+                subject = self.rules.untis_search.apply(subject)
 
                 # get all groups of the grade
-                try:
-                    matches = self.untis_data.loc[grade]
-                except(KeyError):
+                if(not self.untis_index.has_grade(grade)):
                     self.errors.add_error("error", grade, "no UNTIS matches", "grade has no matches in UNTIS")
                     return ""
 
-                if(isinstance(matches, pandas.core.series.Series)):
-                    # handling single matches the same way as multi matches
-                    matches = [matches]
-                
-                found = False
-                for i in range(len(matches)):
-                    if(isinstance(matches, list)):
-                        match = matches[i]
-                    else:
-                        match = matches.iloc[i]
-
-                    # compare subjects
-                    if(match[self.untis_cols["subject"]] == subject):
-                        edited_groups += group + ";"
-                        found = True
-                        break
-                
-                if(not found):
+                # compare subjects
+                if(self.untis_index.grade_has_subject(grade, subject)):
+                    edited_groups += group + ";"
+                else:
                     # log deleted groups for debugging purposes
                     self.deleted_groups.append(group)
 
@@ -316,62 +1547,193 @@ class Students:
         self.schild_data = self.schild_data.reindex(columns=['Vorname','Nachname','Klasse','Import-ID','Gruppen'])
 
         print("Set main names and groups ...")
-        total_students = len(self.schild_data)
-        info_step = int(total_students / 10)
-        formatted_students = 0
+        if(self.delta is not None):
+            self.__format_students_delta()
+        elif(self.stream):
+            print("Writing ISERV_SUS file while formatting ...")
+            self.writer = StreamingCsvWriter(self.output_file, self.schild_data.columns)
+            self.__format_students_engine()
+            self.writer.close()
+        else:
+            self.__format_students_engine()
+
+        # some logs for debugging
+        self.deleted_groups = list(set(self.deleted_groups))
+        print("Deleted", len(self.deleted_groups), "groups because they weren't found in Untis:")
+        output = ""
+        for group in self.deleted_groups:
+            output += group + "\t"
+        print(output)
+
+        print("Formatted students with", len(self.errors), "errors or warnings: ")
+        if(self.verbose):
+            print(self.errors.get_errors_verbose())
+        else:
+            print(self.errors)
+
+    def __format_students_engine(self):
+        # canonical grades of the students which are formatted
+        self.grades = get_grade_columns(self.schild_data["Klasse"])
+        if(self.engine == "vectorized" and self.writer is None):
+            self.__format_students_vectorized(self.schild_data)
+        elif(self.engine == "vectorized"):
+            # format and write the students chunk by chunk
+            for column in ["Vorname", "Gruppen"]:
+                self.schild_data[column] = self.schild_data[column].astype(object)
+            for start in range(0, len(self.schild_data), STREAM_CHUNK_SIZE):
+                students = self.schild_data.iloc[start:start + STREAM_CHUNK_SIZE].copy()
+                self.__format_students_vectorized(students)
+                self.schild_data.loc[students.index, ["Vorname", "Gruppen"]] = students[["Vorname", "Gruppen"]]
+                self.writer.write_rows(students.itertuples(index=False, name=None))
+        else:
+            self.__format_students_loop()
+
+    # fingerprint of everything the result of a student depends on
+    def __get_student_fingerprints(self, students):
+        mappings = self.rules.fingerprint
+        gomsth_students = {}
+        untis_subjects = {}
+        fingerprints = []
+        for row in zip(students["Vorname"], students["Nachname"], students["Klasse"], students["Import-ID"], students["Gruppen"]):
+            row = to_json_row(row)
+            surname = row[1]
+            grade = row[2]
+            if(is_SEKII(grade)):
+                # all GOMSTH students with the same lastname are relevant for matching
+                if(surname not in gomsth_students):
+                    positions = self.gomsth_matcher.surnames.get(surname, [])
+                    gomsth_students[surname] = get_fingerprint([to_json_row(self.gomsth_data.iloc[position].tolist()) for position in positions])
+                context = gomsth_students[surname]
+            else:
+                if(grade not in untis_subjects):
+                    untis_subjects[grade] = get_fingerprint([self.untis_index.has_grade(grade), sorted(self.untis_index.grade_subjects.get(grade, []))])
+                context = untis_subjects[grade]
+            fingerprints.append(get_fingerprint([row, context, mappings]))
+        return fingerprints
+
+    # only format the students whose inputs have changed since the last run
+    def __format_students_delta(self):
+        students = self.schild_data
+        previous = self.delta.get_previous("students")
+        keys = get_record_keys(students["Import-ID"])
+        fingerprints = self.__get_student_fingerprints(students)
+        changed = pandas.Series([key not in previous or previous[key]["fingerprint"] != fingerprint for key, fingerprint in zip(keys, fingerprints)], index=students.index)
+        print("Recomputing", changed.sum(), "of", len(students), "students (delta mode) ...")
+
+        students["Vorname"] = students["Vorname"].astype(object)
+        students["Gruppen"] = students["Gruppen"].astype(object)
+        extras = {}
+        if(changed.any()):
+            self.schild_data = students[changed].reset_index(drop=True)
+            self.errors.log = []
+            self.record_extras = [{"deleted_groups": [], "errors": []} for i in range(len(self.schild_data))]
+            self.__format_students_engine()
+            extras = dict(zip([key for key, is_changed in zip(keys, changed) if is_changed], self.record_extras))
+            self.errors.log = None
+            self.record_extras = None
+            students.loc[changed, "Vorname"] = self.schild_data["Vorname"].to_numpy()
+            students.loc[changed, "Gruppen"] = self.schild_data["Gruppen"].to_numpy()
+        if(not changed.all()):
+            unchanged_keys = [key for key, is_changed in zip(keys, changed) if not is_changed]
+            students.loc[~changed, "Vorname"] = [previous[key]["Vorname"] for key in unchanged_keys]
+            students.loc[~changed, "Gruppen"] = [previous[key]["Gruppen"] for key in unchanged_keys]
+            self.control_groups.extend(";".join(students["Gruppen"][~changed]).split(";"))
+            # report the errors and deleted groups of the restored students again
+            for key in unchanged_keys:
+                extras[key] = {"deleted_groups": previous[key]["deleted_groups"], "errors": previous[key]["errors"]}
+                self.deleted_groups.extend(previous[key]["deleted_groups"])
+                for error in previous[key]["errors"]:
+                    self.errors.add_error(*error)
+        self.schild_data = students
+
+        records = {}
+        for key, fingerprint, row in zip(keys, fingerprints, students.itertuples(index=False)):
+            row = to_json_row(row)
+            records[key] = {"fingerprint": fingerprint, "Vorname": row[0], "Gruppen": row[4], "row": row,
+                            "deleted_groups": extras[key]["deleted_groups"], "errors": extras[key]["errors"]}
+        self.delta.set_current("students", records)
+
+    # format all students column by column
+    def __format_students_vectorized(self, students):
+        grades = students["Klasse"]
+        full_names = students["Vorname"]
+        sekII = self.grades["sekII"].loc[students.index]
+        sekI = ~sekII
+
+        # get main firstnames
+        with self.instrumentation.stage("students: main names"):
+            first_names = pandas.Series(self.__find_main_names(full_names.tolist(), students["Nachname"].tolist(), students.index), index=students.index, dtype=object)
+
+        # all SEKII groups in SchILD are wrong -> remove all SchILD groups and add GOMSTH groups
+        groups = students["Gruppen"].astype(object)
+        if(sekII.any()):
+            groups[sekII] = self.__map("students: GOMSTH matching", self.gomsth_matcher.get_sekII_groups, students.index[sekII], first_names[sekII], full_names[sekII], students["Nachname"][sekII], grades[sekII])
+
+        # add exchange groups
+        groups = groups.fillna("")
+        groups = ((groups + ";").where(groups.str.len() > 0, "") + "Austausch " + grades).astype(object)
+
+        # check if all sekI groups are ok (against UNTIS and manual matches)
+        if(sekI.any()):
+            groups[sekI] = self.__map("students: SEKI check", self.__check_sekI_groups, students.index[sekI], grades[sekI], groups[sekI])
+
+        students["Vorname"] = first_names
+        students["Gruppen"] = groups
+
+        # add control groups
+        self.control_groups.extend(";".join(groups).split(";"))
+
+    # format all students row by row
+    def __format_students_loop(self):
+        progress = ProgressReporter("students", len(self.schild_data))
+        latencies = self.instrumentation.get_histogram("students")
         # main loop for each student
         for i in range(len(self.schild_data)):
+            start = time.perf_counter()
             # get main firstname
             full_name = self.schild_data["Vorname"][i]
-            self.schild_data.loc[i, "Vorname"] = self.__find_main_names(self.schild_data["Vorname"][i])
+            with self.instrumentation.stage("students: main names"):
+                self.schild_data.loc[i, "Vorname"] = self.__find_main_names([full_name], [self.schild_data["Nachname"][i]], [i])[0]
 
-            if(is_SEKII(self.schild_data["Klasse"][i])):
+            sekII = self.grades["sekII"][i]
+            if(sekII):
                 # all SEKII groups in SchILD are wrong -> remove all SchILD groups and add GOMSTH groups
-                self.schild_data.loc[i, "Gruppen"] = self.__get_sekII_groups({"Vorname": self.schild_data["Vorname"][i], "full_name": full_name, "Nachname": self.schild_data["Nachname"][i], "Klasse": self.schild_data["Klasse"][i]})
+                with self.instrumentation.stage("students: GOMSTH matching"):
+                    self.schild_data.loc[i, "Gruppen"] = self.__track(i, self.__get_sekII_groups, {"Vorname": self.schild_data["Vorname"][i], "full_name": full_name, "Nachname": self.schild_data["Nachname"][i], "Klasse": self.schild_data["Klasse"][i]})
                 
             # add exchange groups
             groups = self.__add_course_groups(self.schild_data["Gruppen"][i], self.schild_data["Klasse"][i])
-            if(not is_SEKII(self.schild_data["Klasse"][i])):
+            if(not sekII):
                 # check if all sekI groups are ok (against UNTIS and manual matches)
-                groups = self.__check_sekI_groups(self.schild_data["Klasse"][i], groups)
+                with self.instrumentation.stage("students: SEKI check"):
+                    groups = self.__track(i, self.__check_sekI_groups, self.schild_data["Klasse"][i], groups)
 
             self.schild_data.loc[i, "Gruppen"] = groups
 
             # add control groups
             self.__add_control_groups(self.schild_data["Gruppen"][i])
 
-            formatted_students += 1
-            if((formatted_students % info_step) == 0):
-                print(int(formatted_students / total_students * 100), "%")
-        
-        # some logs for debugging
-        self.deleted_groups = list(set(self.deleted_groups))
-        print("Deleted", len(self.deleted_groups), "groups because they weren't found in Untis:")
-        output = ""
-        for group in self.deleted_groups:
-            output += group + "\t"
-        print(output)
+            if(self.writer is not None):
+                self.writer.write_row(self.schild_data.loc[i].tolist())
 
-        print("Formatted students with", len(self.errors), "errors or warnings: ")
-        if(self.verbose):
-            print(self.errors.get_errors_verbose())
-        else:
-            print(self.errors)
+            latencies.add(time.perf_counter() - start)
+            progress.update()
 
     def __read_schild(self):
         print("Reading SCHILD_SUS file ...")
-        self.schild_data = pandas.read_csv(self.schild_file, sep=";")
+        self.schild_data = self.loader.read_csv(self.schild_file, **SOURCE_OPTIONS["schild"])
         print("Successfully read SCHILD_SUS file. Found ", len(self.schild_data), " students.")
 
     def __read_gomsth(self):
         print("Reading GOMSTH_SUS file ...")
-        self.gomsth_data =  pandas.read_csv(self.gomsth_file, sep=",", index_col="FAMILIENNAME")
+        self.gomsth_data = self.loader.read_csv(self.gomsth_file, index_col="FAMILIENNAME", **SOURCE_OPTIONS["gomsth"])
+        self.gomsth_matcher = GomsthMatcher(self.gomsth_data, self.errors, self.rules)
         print("Successfully read GOMSTH_SUS file. Found ", len(self.gomsth_data), " students.")
 
     def __read_untis(self):
         print("Reading UNTIS_SUS file ...")
-        self.untis_data =  pandas.read_csv(self.untis_file, sep=",", index_col=4, header=None)
-        print("Successfully read UNTIS_SUS file. Found ", len(self.untis_data), " teachers.")
+        self.untis_index = self.loader.get_untis_index(self.untis_file)
+        print("Successfully read UNTIS_SUS file. Found ", len(self.untis_index), " teachers.")
 
     def read_data(self):
         self.__read_schild()
@@ -379,17 +1741,22 @@ class Students:
         self.__read_untis()
 
     def write_iserv(self):
+        if(self.writer is not None):
+            print("Successfully wrote", self.writer.written_rows, "students to ISERV_SUS file while formatting.")
+            return
         print("Writing ISERV_SUS file ...")
-        self.schild_data.to_csv(self.output_file, sep=";", index=False, quoting=csv.QUOTE_NONNUMERIC)
+        with self.instrumentation.stage("students: write"):
+            self.schild_data.to_csv(self.output_file, sep=";", index=False, quoting=csv.QUOTE_NONNUMERIC)
+            if(self.delta is not None):
+                self.delta.write_delta_files("students", self.schild_data, self.output_file, sep=";", index=False, quoting=csv.QUOTE_NONNUMERIC)
         print("Successfully wrote ISERV_SUS file.")
 
     def get_control_groups(self):
         return list(set(self.control_groups))
 
 class Teachers:
-    untis_cols = {"grade": 4, "subject": 6, "course": 41}
 
-    def __init__(self, schild_file, untis_file, class_teachers_file, output_file, group_owners_file, control_groups_students, verbose=False):
+    def __init__(self, schild_file, untis_file, class_teachers_file, output_file, group_owners_file, control_groups_students, verbose=False, loader=None, delta=None, stream=False, instrumentation=None, rules=None):
         self.schild_file = schild_file
         self.untis_file = untis_file
         self.class_teachers_file = class_teachers_file
@@ -397,36 +1764,38 @@ class Teachers:
         self.group_owners_file = group_owners_file
         self.errors = Errors()
         self.control_groups = []
-        self.control_groups_students = control_groups_students
         self.verbose = verbose
-        self.group_owners = pandas.DataFrame(columns=["nutzer.name", "klasse"])
+        self.group_owners = GroupOwners()
+        # groups the current teacher owns (only in delta mode)
+        self.owned_groups = None
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.loader = loader if loader is not None else SourceLoader(instrumentation=self.instrumentation)
+        self.rules = rules if rules is not None else MappingRules()
+        self.set_control_groups_students(control_groups_students)
+        self.delta = delta
+        self.stream = stream and delta is None
+        self.writer = None
         self.deleted_groups = []
+        self.prepared = False
 
     def __add_control_groups(self, groups):
         for group in groups.split(";"):
             self.control_groups.append(group)
 
+    # the groups of the students are needed for finding the right course names (may be set after the teachers are prepared)
+    def set_control_groups_students(self, control_groups_students):
+        self.control_groups_students = control_groups_students
+        self.student_groups = set(control_groups_students)
+        self.course_index = CourseIndex(self.student_groups, self.rules.teacher_courses)
+
     def __get_teached_classes_in_grade(self, teacher, group, grade):
         subject = group.split(" ")[0]
-        if(subject[:-1] in MANUAL_UNTIS_SEARCH_MAPPINGS):
-            subject = MANUAL_UNTIS_SEARCH_MAPPINGS[subject[:-1]] # TODO this is very manual!
+        subject = self.rules.untis_search.get(subject[:-1], subject) # TODO this is very manual!
 
-        try:
-            matches = self.untis_data.loc[teacher]
-        except(KeyError):
+        if(not self.untis_index.has_teacher(teacher)):
             return []
 
-        if(isinstance(matches, pandas.core.series.Series)):
-            matches = [matches]
-        
-        classes = []
-        for i in range(len(matches)):
-            if(isinstance(matches, list)):
-                match = matches[i]
-            else:
-                match = matches.iloc[i]
-            if(subject.startswith(match[self.untis_cols["subject"]]) and match[self.untis_cols["grade"]].startswith(grade)):
-                classes.append(match[self.untis_cols["grade"]])
+        classes = self.untis_index.find_grades(teacher, subject, grade)
 
         if(len(classes) == 0):
             #if(recursive):
@@ -451,24 +1820,17 @@ class Teachers:
             else:
                 group_grade = splitted_groups[1]
 
-            try:
-                group_grade = int(group_grade)
-                if(group_grade < 10):
-                    #print(group)
-                    classes = self.__get_teached_classes_in_grade(teacher, group, str(group_grade))
-                    #print(classes)
+            # numbers (05) and ranges (11-12) are parsed once per different grade
+            levels = parse_grade(group_grade).levels
+            if(len(levels) == 0):
+                grades.append(group_grade)
+            for level in levels:
+                if(level < 10):
+                    classes = self.__get_teached_classes_in_grade(teacher, group, str(level))
                     for class_s in classes:
                         grades.append(class_s)
-                    #grades.append(str(group_grade) + "b")
-                    #grades.append(str(group_grade) + "c")
                 else:
-                    grades.append(to_string_grade(str(group_grade)))
-            except:
-                if(group_grade == "11-12"):
-                    grades.append(to_string_grade("11"))
-                    grades.append(to_string_grade("12"))
-                else:
-                    grades.append(group_grade)
+                    grades.append(to_string_grade(str(level)))
 
 
             # add teacher as group owner of this group
@@ -485,22 +1847,22 @@ class Teachers:
         if teacher in self.class_teachers_data:
             sections = {"o": False, "m":False, "u":False}
             for s_class in self.class_teachers_data[teacher]:
-                if not is_SEKII(s_class["class"]):
-                    groups += "Klasse " + s_class["class"] + ";"
-                    if( int(s_class["class"][0]) <= 7):
+                if not s_class.sekII:
+                    groups += "Klasse " + s_class.grade + ";"
+                    if(s_class.level is not None and s_class.level <= 7):
                         sections["u"] = True
                     else:
                         sections["m"] = True
                 else:
-                    groups += "Jahrgang " + s_class["class"] + ";"
+                    groups += "Jahrgang " + s_class.grade + ";"
                     sections["o"] = True
-                if s_class["type"] == 1:
-                    if not is_SEKII(s_class["class"]):
-                        self.__add_group(username, "Klasse " + s_class["class"])
+                if s_class.type == 1:
+                    if not s_class.sekII:
+                        self.__add_group(username, "Klasse " + s_class.grade)
                     else:
-                        self.__add_group(username, "Jahrgang " + s_class["class"])
-                    self.__add_group(username, "Austausch " + s_class["class"])
-                    self.__add_group(username, "Lehrer " + s_class["class"])
+                        self.__add_group(username, "Jahrgang " + s_class.grade)
+                    self.__add_group(username, "Austausch " + s_class.grade)
+                    self.__add_group(username, "Lehrer " + s_class.grade)
 
             if sections["m"]:
                 groups += "Klassenlehrer Mittelstufe;"
@@ -512,63 +1874,60 @@ class Teachers:
 
         return groups[:-1]
 
-    def __find_correct_course_name(self, names):
-        for name in names:
-            try:
-                name = MANUAL_TEACHER_COURSE_MAPPINGS[name]
-            except KeyError:
-                pass
-            if(self.__student_group_exists(name)):
-                return name
-
-        # return first one
-        return names[0]
+    # find the name of the course in the groups of the students, variants are (subject, course number) in the order of
+    # preference (the first one is returned if nothing is found)
+    def __find_correct_course_name(self, grade, kind, teacher, variants, course_id):
+        ranks = {}
+        for position, variant in enumerate(variants):
+            ranks.setdefault(variant, position)
+        subject, number = variants[0]
+        return self.__find_course(subject, grade, kind, teacher, lambda *variant: ranks.get(variant), subject + "_" + grade + "_" + kind + number + "_" + teacher, course_id)
+
+    def __find_course(self, subject, grade, kind, teacher, rank, default, course_id):
+        matches = self.course_index.find(subject, grade, kind, teacher, rank)
+        if(len(matches) > 1):
+            self.errors.add_error("warning", course_id, "ambiguous course name", "found multiple matching student groups " + ", ".join(matches) + " - using " + matches[0])
+        if(len(matches) > 0):
+            return matches[0]
+        # prefix and regex mappings are only applied to the preferred name
+        mapped = self.rules.teacher_courses.apply(default)
+        if(mapped != default and self.__student_group_exists(mapped)):
+            return mapped
+        return default
 
     def __add_group(self, username, group):
-        group = group.lower().replace(" ", ".").replace("_", ".")
-        self.group_owners.loc[len(self.group_owners)] = [username, group]
+        group = get_group_account(group)
+        self.group_owners.add(username, group)
+        if(self.owned_groups is not None):
+            self.owned_groups.append(group)
         return group
 
     def __get_untis_groups(self, teacher):
-        try:
-            matches = self.untis_data.loc[teacher]
-        except(KeyError):
+        lessons = self.untis_index.get_lessons(teacher)
+        if(lessons is None):
             self.errors.add_error("error", teacher, "no UNTIS matches", "teacher has no matches in UNTIS")
             return ""
 
-        if(isinstance(matches, pandas.core.series.Series)):
-            matches = [matches]
-        
         courses = [] # store courses to detect duplicates
-        pe_courses = []
+        pe_courses = set()
         groups = ""
-        for i in range(len(matches)):
-            if(isinstance(matches, list)):
-                match = matches[i]
-            else:
-                match = matches.iloc[i]
-
+        for lesson in lessons:
             # not SEKII courses should already have been extracted from schild
-            if(is_SEKII(match[self.untis_cols["grade"]])):
-                course = array_remove_empties(match[self.untis_cols["subject"]].split(" "))
-                subject = course[0].upper() # all subjects should be in uppercase
-                if(subject == "SPT"):
+            if(lesson.sekII):
+                course = lesson.course
+                if(lesson.course_subject == "SPT"):
                     #self.errors.add_error("error", teacher, "SPT course cannot be handled", "SPT course is unknown")
                     # theoretical sport courses don't need a group
                     continue
                 if (len(course) < 2):
                     self.errors.add_error("error", teacher, "no course number", "course " + str(course) + " has no number - ignoring")
                     continue
-                number = course[1][1:]
-                course_type = course[1][:1]
-                grade = to_number_grade(match[self.untis_cols["grade"]])
-                subject_number = -1
-                try:
-                    #remove numbers at the end of a subject
-                    subject_number = int(subject[-1:])
-                    subject = subject[:-1]
-                except:
-                    pass
+                # split when UNTIS was read
+                number = lesson.number
+                course_type = lesson.course_type
+                grade = lesson.number_grade
+                subject_number = lesson.subject_number
+                subject = lesson.stem
                 #print(number, "|", course_type, "|", subject)
                 if(len(number) == 0 or len(course_type) == 0 or len(subject) == 0):
                     print("error")
@@ -585,44 +1944,29 @@ class Teachers:
                     courses.append(course_id)
 
                 if(course_type == "L"):
-                    group1 = subject + "_" + grade + "_" + "LK" + number + "_" + teacher
-                    group2 = subject + "_" + grade + "_" + "LK" + number_to_char(number) + "_" + teacher
+                    variants = [(subject, number), (subject, number_to_char(number))]
                     if(subject_number != -1):
-                        group3 = subject + str(subject_number) + "_" + grade + "_" + "LK" + number + "_" + teacher
-                        group4 = subject + str(subject_number) + "_" + grade + "_" + "LK" + number_to_char(number) + "_" + teacher
-                        groups += self.__find_correct_course_name([group1, group2, group3, group4])
-                    else:
-                        groups += self.__find_correct_course_name([group1, group2])
+                        variants += [(subject + str(subject_number), number), (subject + str(subject_number), number_to_char(number))]
+                    groups += self.__find_correct_course_name(grade, "LK", teacher, variants, course_id)
                 elif(course_type == "G"):
                     if(subject.lower() == "iv"):
                         subject = "VP-IP"
-                    group = subject + "_" + grade + "_" + "GK" + number + "_" + teacher
                     if(subject_number != -1):
-                        group2 = subject + str(subject_number) + "_" + grade + "_" + "GK" + number + "_" + teacher
-                        groups += self.__find_correct_course_name([group, group2])
+                        groups += self.__find_correct_course_name(grade, "GK", teacher, [(subject, number), (subject + str(subject_number), number)], course_id)
                     elif(subject.lower() == "sp"):
                         #different PE profiles
-                        # one teacher may have multiple PE courses with different profiles and the numbers of the courses are different
-                        possible_names = [group]
-                        for i in range(1,4):
-                            for i2 in range(1, int(number)+1):
-                                group = subject + str(i) + "_" + grade + "_" + "GK" + str(i2) + "_" + teacher
-                                try:
-                                    pe_courses.index(group)
-                                except ValueError:
-                                    possible_names.append(group)
-                        found_group = self.__find_correct_course_name(possible_names)
-                        pe_courses.append(found_group)
+                        # one teacher may have multiple PE courses with different profiles (SP1 - SP3) and the numbers of the courses are different
+                        group = subject + "_" + grade + "_" + "GK" + number + "_" + teacher
+                        found_group = self.__find_course(subject, grade, "GK", teacher, self.__get_pe_rank(subject, grade, number, teacher, pe_courses), group, course_id)
+                        pe_courses.add(found_group)
                         groups += found_group
                     else:
-                        groups += self.__find_correct_course_name([group])
+                        groups += self.__find_correct_course_name(grade, "GK", teacher, [(subject, number)], course_id)
                 elif(course_type == "V"):
-                    group = "V" + subject + "_" + grade + "_" + "GK" + number + "_" + teacher
                     if(subject_number != -1):
-                        group2 = "V" + subject + str(subject_number) + "_" + grade + "_" + "GK" + number + "_" + teacher
-                        groups += self.__find_correct_course_name([group, group2])
+                        groups += self.__find_correct_course_name(grade, "GK", teacher, [("V" + subject, number), ("V" + subject + str(subject_number), number)], course_id)
                     else:
-                        groups += group
+                        groups += "V" + subject + "_" + grade + "_" + "GK" + number + "_" + teacher
                 elif(course_type == "Z"):
                     #ZKs don't have numbers (GE/SW)
                     if(subject.lower() == "ge"):
@@ -642,71 +1986,56 @@ class Teachers:
                 groups += ";"
         return groups[:-1]
 
+    # the course itself is preferred, then the profiles SP1 - SP3 with course numbers up to the number of the course (unused ones only)
+    def __get_pe_rank(self, subject, grade, number, teacher, pe_courses):
+        courses = int(number)
+
+        def rank(course_subject, course_number):
+            if(course_subject == subject and course_number == number):
+                return 0
+            profile = course_subject[len(subject):]
+            if(course_subject[:len(subject)] != subject or profile not in ["1", "2", "3"] or not course_number.isdigit() or course_number != str(int(course_number))):
+                return None
+            if(not 1 <= int(course_number) <= courses):
+                return None
+            if(course_subject + "_" + grade + "_GK" + course_number + "_" + teacher in pe_courses):
+                return None
+            return 1 + (int(profile) - 1) * courses + int(course_number) - 1
+        return rank
+
     def __student_group_exists(self, group):
-        try:
-            self.control_groups_students.index(group)
-            return True
-        except ValueError:
-            return False
+        return group in self.student_groups
 
     def __check_sekI_groups(self, teacher, groups):
         edited_groups = ""
         if(len(groups) == 0):
             return ""
         for group in groups.split(";"):
-            if(group.startswith("Fuellsel")):
+            action, group = self.rules.teacher_groups.apply(group)
+            if(action == "skip"):
                 continue
-            if(group in NOT_IN_UNTIS_EXCEPTIONS):
+            if(action == "keep"):
                 edited_groups += group + ";"
                 continue
-            elif(group in MANUAL_SEKI_MAPPINGS):
-                group = MANUAL_SEKI_MAPPINGS[group]
             splitted_group = group.split(" ")
-            subject = splitted_group[0]
+            subject = strip_subject_number(splitted_group[0])
             grade = splitted_group[1]
-            if(len(subject) > 2):
-                #self.errors.add_error("warning", subject, "long subject detected", "long subject detected - searching without last digit")
-                try:
-                    number = int(subject[-1:])
-                    subject = subject[:-1]
-                except ValueError:
-                    pass
 
-            if(subject in MANUAL_UNTIS_SEARCH_MAPPINGS):
-                    subject = MANUAL_UNTIS_SEARCH_MAPPINGS[subject]
+            subject = self.rules.untis_search.apply(subject)
 
-            try:
-                grade = str(int(grade))
-            except ValueError:
-                pass
+            levels = parse_grade(grade).levels
+            if(len(levels) == 1):
+                grade = str(levels[0])
 
-            try:
-                matches = self.untis_data.loc[teacher]
-            except(KeyError):
+            if(not self.untis_index.has_teacher(teacher)):
                 #self.errors.add_error("error", teacher, "no UNTIS matches", "teacher has no matches in UNTIS")
                 # already logged
                 self.deleted_groups.append(group)
                 continue
 
-            if(isinstance(matches, pandas.core.series.Series)):
-                matches = [matches]
-            
-            found = False
-            for i in range(len(matches)):
-                if(isinstance(matches, list)):
-                    match = matches[i]
-                else:
-                    match = matches.iloc[i]
-
-                #if (subject.startswith("TWM")):
-                #    print(match[self.untis_cols["subject"]])
-                #    print(match[self.untis_cols["grade"]])
-                if(subject.startswith(match[self.untis_cols["subject"]]) and match[self.untis_cols["grade"]].startswith(grade)):
-                    edited_groups += group + ";"
-                    found = True
-                    break
-            
-            if(not found):
+            if(self.untis_index.teaches(teacher, subject, grade)):
+                edited_groups += group + ";"
+            else:
                 self.deleted_groups.append(group)
 
         return edited_groups[:-1]
@@ -721,46 +2050,76 @@ class Teachers:
             if( not self.__student_group_exists(group)):
                 self.errors.add_error("warning", group, "teachers only group", "group not found in students file")
 
-    def format_teachers(self):
+    # everything which doesn't depend on the students (usernames and sekI groups)
+    def prepare_teachers(self):
+        if(self.prepared):
+            return
         print("Formating teachers ...")
         print("Rearrange columns ...")
         self.schild_data = self.schild_data.reindex(columns=['Vorname','Nachname','Information','ID','Gruppen'])
+        # the unformatted rows are needed for detecting changes
+        self.input_rows = [to_json_row(row) for row in self.schild_data.itertuples(index=False, name=None)]
 
-        print("Set groups ...")
-        total_teachers = len(self.schild_data)
-        info_step = int(total_teachers / 10)
-        formatted_teachers = 0
-        for i in range(len(self.schild_data)):
-            groups = ""
-            if(not pandas.isna(self.schild_data["Gruppen"][i])):
-                groups = self.schild_data["Gruppen"][i]
-
-            name = self.schild_data["Vorname"][i].split(" ")[0]
-            if(name in MANUAL_TEACHER_NAME_MAPPINGS):
-                name = MANUAL_TEACHER_NAME_MAPPINGS[name]
-            self.schild_data.loc[i, "Vorname"] = name
-
-            if(self.schild_data["Nachname"][i] in MANUAL_TEACHER_SURNAME_MAPPINGS):
-                self.schild_data.loc[i, "Nachname"] = MANUAL_TEACHER_SURNAME_MAPPINGS[self.schild_data["Nachname"][i]]
+        print("Set usernames ...")
+        with self.instrumentation.stage("teachers: usernames"):
+            self.usernames = self.__generate_usernames()
 
-            username = (self.schild_data["Vorname"][i] + "." + self.schild_data["Nachname"][i]).lower()
-            replacements = [["ä","ae"], ["ö","oe"], ["ü","ue"], ["ß","ss"]]
-            for replacement in replacements:
-                username = username.replace(replacement[0], replacement[1])
+        # check whether all sekI groups are listed in untis
+        print("Check sekI groups ...")
+        self.sekI_groups = self.instrumentation.map("teachers: SEKI check", self.__check_sekI_groups, self.schild_data["Information"], self.schild_data["Gruppen"].fillna(""))
+        self.prepared = True
 
-            if(username in MANUAL_USERNAME_MAPPINGS):
-                username = MANUAL_USERNAME_MAPPINGS[username]
+    def format_teachers(self):
+        self.prepare_teachers()
 
-            # check whether there is some unknown character left:
-            for char in username:
-                if not ((ord(char) >= 65 and ord(char) <= 90) or (ord(char) >= 97 and ord(char) <= 122) or (ord(char) >= 45 and ord(char) <= 46)):
-                    self.errors.add_error("error", username, "wrong character found", "found the character '" + char + "' in username")
+        print("Set groups ...")
+        if(self.delta is not None):
+            previous = self.delta.get_previous("teachers")
+            keys = get_record_keys(self.schild_data["ID"])
+            fingerprints = self.__get_teacher_fingerprints()
+            changed = [key not in previous or previous[key]["fingerprint"] != fingerprint for key, fingerprint in zip(keys, fingerprints)]
+            print("Recomputing", sum(changed), "of", len(changed), "teachers (delta mode) ...")
+            self.schild_data["Gruppen"] = self.schild_data["Gruppen"].astype(object)
+            # errors and owned groups of every teacher (the deleted sekI groups are always checked for all teachers)
+            record_errors = []
+            record_owned_groups = []
+            self.errors.log = []
+        usernames = self.usernames
+        if(self.stream):
+            print("Writing ISERV_LUL file while formatting ...")
+            self.writer = StreamingCsvWriter(self.output_file, self.schild_data.columns)
+
+        progress = ProgressReporter("teachers", len(self.schild_data))
+        latencies = self.instrumentation.get_histogram("teachers")
+        for i in range(len(self.schild_data)):
+            start = time.perf_counter()
+            if(self.delta is not None and not changed[i]):
+                # restore the result of the last run
+                record = previous[keys[i]]
+                self.schild_data.loc[i, "Vorname"] = record["Vorname"]
+                self.schild_data.loc[i, "Nachname"] = record["Nachname"]
+                self.schild_data.loc[i, "Gruppen"] = record["Gruppen"]
+                # the username of this run (it may have changed because of other teachers)
+                for group in record["owned_groups"]:
+                    self.group_owners.add(usernames[i], group)
+                record_owned_groups.append(record["owned_groups"])
+                self.__add_control_groups(record["Gruppen"])
+                # report the errors of the restored teacher again
+                for error in record["errors"]:
+                    self.errors.add_error(*error)
+                record_errors.append(record["errors"])
+                progress.update()
+                continue
 
-            # check whether all sekI groups are listed in untis
-            groups = self.__check_sekI_groups(self.schild_data["Information"][i], groups)
+            if(self.delta is not None):
+                errors = len(self.errors.log)
+                self.owned_groups = []
+            username = usernames[i]
+            groups = self.sekI_groups[i]
 
             # add sekII course groups
-            untis_groups = self.__get_untis_groups(self.schild_data["Information"][i])
+            with self.instrumentation.stage("teachers: UNTIS groups"):
+                untis_groups = self.__get_untis_groups(self.schild_data["Information"][i])
             
             if(len(untis_groups) > 0):
                 if(len(groups) > 0):
@@ -769,7 +2128,8 @@ class Teachers:
                     groups = untis_groups
 
             # add "Austausch xy", "Lehrer xy" and "Klasse xy"
-            grade_groups = self.__get_grade_groups(self.schild_data["Information"][i], username, groups)
+            with self.instrumentation.stage("teachers: grade groups"):
+                grade_groups = self.__get_grade_groups(self.schild_data["Information"][i], username, groups)
             if(len(grade_groups) > 0):
                 if(len(groups) > 0):
                     groups += ";" + grade_groups
@@ -779,11 +2139,29 @@ class Teachers:
             self.schild_data.loc[i, "Gruppen"] = groups
             self.__add_control_groups(groups)
             self.__check_control_groups(groups)
+            if(self.delta is not None):
+                record_errors.append(self.errors.log[errors:])
+                record_owned_groups.append(self.owned_groups)
+                self.owned_groups = None
+
+            if(self.writer is not None):
+                self.writer.write_row(self.schild_data.loc[i].tolist())
+
+            latencies.add(time.perf_counter() - start)
+            progress.update()
+
+        if(self.writer is not None):
+            self.writer.close()
+
+        if(self.delta is not None):
+            self.errors.log = None
+            records = {}
+            for key, fingerprint, owned_groups, errors, row in zip(keys, fingerprints, record_owned_groups, record_errors, self.schild_data.itertuples(index=False)):
+                row = to_json_row(row)
+                records[key] = {"fingerprint": fingerprint, "Vorname": row[0], "Nachname": row[1], "Gruppen": row[4],
+                                "owned_groups": owned_groups, "errors": errors, "row": row}
+            self.delta.set_current("teachers", records)
 
-            formatted_teachers += 1
-            if((formatted_teachers % info_step) == 0):
-                print(int(formatted_teachers / total_teachers * 100), "%")
-        
         self.deleted_groups = list(set(self.deleted_groups))
         print("Deleted", len(self.deleted_groups), "groups because they weren't found in Untis:")
         output = ""
@@ -797,27 +2175,78 @@ class Teachers:
         else:
             print(self.errors)
 
+    # set the firstnames and lastnames and generate the usernames of all teachers at once
+    def __generate_usernames(self):
+        first_names = self.rules.teacher_names.apply_column(self.schild_data["Vorname"].str.split(" ").str[0])
+        surnames = self.rules.teacher_surnames.apply_column(self.schild_data["Nachname"])
+        self.schild_data["Vorname"] = first_names.astype(object)
+        self.schild_data["Nachname"] = surnames.astype(object)
+
+        usernames = self.rules.usernames.apply_column((first_names + "." + surnames).str.lower().str.translate(USERNAME_TRANSLATION))
+
+        # check whether there is some unknown character left
+        for username, characters in zip(usernames, usernames.str.findall(INVALID_USERNAME_CHARACTERS)):
+            for character in characters:
+                self.errors.add_error("error", username, "wrong character found", "found the character '" + character + "' in username")
+
+        # check whether multiple teachers get the same username
+        usernames = usernames.tolist()
+        teachers = self.schild_data["Information"].tolist()
+        self.username_index = {}
+        for position, username in enumerate(usernames):
+            if(username in self.username_index):
+                other_teacher = str(teachers[self.username_index[username]])
+                if(USERNAME_COLLISION_POLICY == "number"):
+                    number = 2
+                    while(username + str(number) in self.username_index):
+                        number += 1
+                    self.errors.add_error("warning", username, "duplicate username", "teachers " + other_teacher + " and " + str(teachers[position]) + " have the same username - using " + username + str(number) + " for " + str(teachers[position]))
+                    username += str(number)
+                    usernames[position] = username
+                else:
+                    self.errors.add_error("error", username, "duplicate username", "teachers " + other_teacher + " and " + str(teachers[position]) + " have the same username")
+                    continue
+            self.username_index[username] = position
+
+        return usernames
+
+    # fingerprint of everything the result of a teacher depends on
+    def __get_teacher_fingerprints(self):
+        mappings = self.rules.fingerprint
+        # course names are chosen by the existing student groups
+        student_groups = get_fingerprint(sorted(self.student_groups, key=str))
+        fingerprints = []
+        for row in self.input_rows:
+            teacher = row[2]
+            lessons = self.untis_index.get_lessons(teacher)
+            if(lessons is not None):
+                lessons = [(lesson.subject, lesson.grade) for lesson in lessons]
+            class_teachers = self.class_teachers_data.get(teacher)
+            if(class_teachers is not None):
+                class_teachers = [{"class": class_teacher.grade, "type": class_teacher.type} for class_teacher in class_teachers]
+            fingerprints.append(get_fingerprint([row, lessons, class_teachers, mappings, student_groups]))
+        return fingerprints
+
     def __read_schild(self):
         print("Reading SCHILD_LUL file ...")
-        self.schild_data = pandas.read_csv(self.schild_file, sep=";")
+        self.schild_data = self.loader.read_csv(self.schild_file, **SOURCE_OPTIONS["schild"])
         print("Successfully read SCHILD_SUS file. Found ", len(self.schild_data), " teachers.")
 
     def __read_untis(self):
         print("Reading UNTIS_LUL file ...")
-        self.untis_data =  pandas.read_csv(self.untis_file, sep=",", index_col=5, header=None)
-        print("Successfully read GOMSTH_SUS file. Found ", len(self.untis_data), " teachers.")
+        self.untis_index = self.loader.get_untis_index(self.untis_file)
+        print("Successfully read GOMSTH_SUS file. Found ", len(self.untis_index), " teachers.")
 
     def __read_class_teachers(self):
         print("Reading CLASS_TEACHERS file ...")
-        raw_class_teachers_data = pandas.read_csv(self.class_teachers_file, sep=",", header=None)
+        raw_class_teachers_data = self.loader.read_csv(self.class_teachers_file, **SOURCE_OPTIONS["class_teachers"])
+        # teacher -> list of ClassTeachers
         self.class_teachers_data = {}
-        for i in range(0, len(raw_class_teachers_data)):
-            data = raw_class_teachers_data[1][i].split(" ")
+        for line in raw_class_teachers_data[1].tolist():
+            data = line.split(" ")
             class_name = data[0]
             for j in range(1, len(data)):
-                if not data[j] in self.class_teachers_data:
-                    self.class_teachers_data[data[j]] = []
-                self.class_teachers_data[data[j]].append({"class": class_name, "type": j })
+                self.class_teachers_data.setdefault(data[j], []).append(ClassTeacher(class_name, j))
 
         #print(self.class_teachers_data)
         print("Successfully read CLASS_TEACHERS file. Found ", len(self.class_teachers_data), " class teachers.")
@@ -828,75 +2257,516 @@ class Teachers:
         self.__read_class_teachers()
 
     def write_iserv(self):
+        if(self.writer is not None):
+            print("Successfully wrote", self.writer.written_rows, "teachers to ISERV_LUL file while formatting.")
+            return
         print("Writing ISERV_LUL file ...")
-        self.schild_data.to_csv(self.output_file, sep=";", index=False, quoting=csv.QUOTE_NONNUMERIC)
+        with self.instrumentation.stage("teachers: write"):
+            self.schild_data.to_csv(self.output_file, sep=";", index=False, quoting=csv.QUOTE_NONNUMERIC)
+            if(self.delta is not None):
+                self.delta.write_delta_files("teachers", self.schild_data, self.output_file, sep=";", index=False, quoting=csv.QUOTE_NONNUMERIC)
         print("Successfully wrote ISERV_LUL file.")
 
     def write_group_owners_file(self):
         print("Writing GROUP_OWNERS file ...")
         print("found", len(self.group_owners), "group owners")
-        self.group_owners.to_csv(self.group_owners_file, sep=",", index=False)
+        print("found", len(self.group_owners.get_group_counts()), "groups with", len(self.group_owners.get_owner_counts()), "different owners")
+        with self.instrumentation.stage("teachers: write group owners"):
+            self.group_owners.write_csv(self.group_owners_file)
+            if(self.delta is not None):
+                self.delta.write_delta_pairs("group_owners", list(self.group_owners.owners), GroupOwners.columns, self.group_owners_file)
         print("Successfully wrote GROUP_OWNERS file.")
 
     def get_control_groups(self):
         return list(set(self.control_groups))
 
-def find_students_only_groups(teachers_groups, students_groups):
-    print("found", len(teachers_groups), "teacher groups")
-    for i in range(len(teachers_groups)):
-        try:
-            students_groups.remove(teachers_groups[i])
-        except ValueError:
-            continue
-    print("Found", len(students_groups), "students only groups:")
-    for i in range(len(students_groups)):
-        print(students_groups[i])
-
-def find_deletion_mismatches(teachers_groups, students_groups):
-    print("found", len(teachers_groups), "deleted teachers groups")
-    print("found", len(students_groups), "deleted students groups")
-    matches = []
-    for i in range(len(teachers_groups)):
-        try:
-            students_groups.remove(teachers_groups[i])
-            matches.append(teachers_groups[i])
-            teachers_groups[i] = ""
-        except ValueError:
-            continue
-    print("Found", len(students_groups), "students only groups:")
-    for i in range(len(students_groups)):
-        print(students_groups[i])
-    teachers_groups = list(set(teachers_groups))
-    print("Found", len(teachers_groups), "teachers only groups:")
-    for i in range(len(teachers_groups)):
-        print(teachers_groups[i])
-    print("Matches:")
-    print(matches)
+# all groups which are left after removing one occurrence for each group in removed_groups (like list.remove, but without changing the lists)
+def subtract_groups(groups, removed_groups):
+    remaining = collections.Counter(removed_groups)
+    result = []
+    for group in groups:
+        if(remaining[group] > 0):
+            remaining[group] -= 1
+        else:
+            result.append(group)
+    return result
 
-def Main():
+# compare the groups and deleted groups of students and teachers (the given lists are not changed)
+def reconcile_groups(teachers_groups, students_groups, teachers_deleted_groups, students_deleted_groups):
+    students_group_set = set(students_groups)
+    teachers_group_set = set(teachers_groups)
+    students_deleted_set = set(students_deleted_groups)
+    return {
+        "teachers_groups": len(teachers_groups),
+        "students_groups": len(students_groups),
+        "students_only_groups": subtract_groups(students_groups, teachers_groups),
+        "teachers_only_groups": [group for group in dict.fromkeys(teachers_groups) if group not in students_group_set],
+        "matched_groups": [group for group in dict.fromkeys(students_groups) if group in teachers_group_set],
+        "deletion_mismatches": {
+            "teachers_deleted_groups": len(teachers_deleted_groups),
+            "students_deleted_groups": len(students_deleted_groups),
+            "students_only_groups": subtract_groups(students_deleted_groups, teachers_deleted_groups),
+            "teachers_only_groups": list(dict.fromkeys(subtract_groups(teachers_deleted_groups, students_deleted_groups))),
+            "matches": [group for group in teachers_deleted_groups if group in students_deleted_set],
+        },
+    }
+
+def print_reconciliation(report):
+    print("found", report["teachers_groups"], "teacher groups")
+    print("Found", len(report["students_only_groups"]), "students only groups:")
+    for group in report["students_only_groups"]:
+        print(group)
+
+    deletions = report["deletion_mismatches"]
+    print("found", deletions["teachers_deleted_groups"], "deleted teachers groups")
+    print("found", deletions["students_deleted_groups"], "deleted students groups")
+    print("Found", len(deletions["students_only_groups"]), "students only deleted groups:")
+    for group in deletions["students_only_groups"]:
+        print(group)
+    print("Found", len(deletions["teachers_only_groups"]), "teachers only deleted groups:")
+    for group in deletions["teachers_only_groups"]:
+        print(group)
+    print("Matches:")
+    print(deletions["matches"])
+
+def get_trigrams(name):
+    padded = "  " + name.lower() + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# levenshtein distance of two strings
+def get_edit_distance(text1, text2):
+    previous = list(range(len(text2) + 1))
+    for i, char1 in enumerate(text1, 1):
+        current = [i]
+        for j, char2 in enumerate(text2, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char1 != char2)))
+        previous = current
+    return previous[-1]
+
+# trigram index for finding names similar to a deleted group, e.g. the UNTIS subject "BI" for the SchILD subject "BIO"
+class SuggestionIndex:
+
+    def __init__(self, names):
+        self.names = list(dict.fromkeys(names))
+        self.trigrams = [get_trigrams(name) for name in self.names]
+        # trigram -> positions of all names containing it
+        self.index = {}
+        for position, trigrams in enumerate(self.trigrams):
+            for trigram in trigrams:
+                self.index.setdefault(trigram, []).append(position)
+
+    # the most similar names as (name, score) tuples; the score is the dice coefficient of the trigrams, equal scores are
+    # ordered by edit distance -> only names sharing at least one trigram are compared
+    def find(self, name, count, accept=None, min_score=0):
+        trigrams = get_trigrams(name)
+        shared = collections.Counter()
+        for trigram in trigrams:
+            shared.update(self.index.get(trigram, ()))
+        candidates = []
+        for position, common in shared.items():
+            candidate = self.names[position]
+            if(candidate == name or (accept is not None and not accept(candidate))):
+                continue
+            score = 2 * common / (len(trigrams) + len(self.trigrams[position]))
+            if(score < min_score):
+                continue
+            candidates.append((-score, get_edit_distance(name.lower(), candidate.lower()), candidate))
+        return [(candidate, round(-score, 3)) for score, distance, candidate in heapq.nsmallest(count, candidates)]
+
+# grade of a SEKI group ("BI 05" -> "5") or None
+def get_group_grade(group):
+    splitted_group = group.split(" ")
+    if(len(splitted_group) < 2):
+        return None
+    try:
+        return str(int(splitted_group[1]))
+    except ValueError:
+        return splitted_group[1]
+
+# similar UNTIS subjects of the same grade (-> untis search mapping) and similar existing groups of the same grade
+# (-> SEKI mapping) for every deleted group whose subject isn't taught in the grade at all (groups of teachers are also
+# deleted if only other teachers teach the subject)
+def suggest_mappings(deleted_groups, untis_index, groups, untis_search, count=None):
+    if(count is None):
+        count = SUGGESTION_COUNT
+    subject_index = SuggestionIndex(sorted(set().union(*untis_index.grade_subjects.values())))
+    group_index = SuggestionIndex(groups)
+    # grade -> UNTIS subjects of all classes of the grade
+    grade_subjects = {}
+    suggestions = []
+    for group in sorted(set(deleted_groups)):
+        subject = strip_subject_number(group.split(" ")[0])
+        grade = get_group_grade(group)
+        if(grade not in grade_subjects):
+            grade_subjects[grade] = set()
+            for untis_grade, subjects in untis_index.grade_subjects.items():
+                if(grade is None or (isinstance(untis_grade, str) and untis_grade.startswith(grade))):
+                    grade_subjects[grade].update(subjects)
+        search_subject = untis_search.apply(subject)
+        if(search_subject in grade_subjects[grade]):
+            continue
+        suggestions.append({"group": group, "subject": subject,
+                            "subjects": subject_index.find(subject, count, grade_subjects[grade].__contains__, SUGGESTION_MIN_SCORE),
+                            "groups": group_index.find(group, count, lambda candidate: get_group_grade(candidate) == grade, SUGGESTION_MIN_SCORE)})
+    return suggestions
+
+def print_suggestions(suggestions):
+    for suggestion in suggestions:
+        subjects = ", ".join(subject + " (" + str(score) + ")" for subject, score in suggestion["subjects"])
+        groups = ", ".join(group + " (" + str(score) + ")" for group, score in suggestion["groups"])
+        print(suggestion["group"] + ":", "subjects:", subjects or "-", "| groups:", groups or "-")
+
+# mappings file with the best candidates: a subject which is deleted in several grades is mapped to the subject with the
+# highest total score, groups without a similar subject are mapped to the most similar group
+def get_suggested_mappings(suggestions):
+    subject_scores = {}
+    group_mappings = {}
+    for suggestion in suggestions:
+        if(len(suggestion["subjects"]) > 0):
+            scores = subject_scores.setdefault(suggestion["subject"], collections.Counter())
+            for subject, score in suggestion["subjects"]:
+                scores[subject] += score
+        elif(len(suggestion["groups"]) > 0):
+            group_mappings[suggestion["group"]] = suggestion["groups"][0][0]
+    return {"untis_search_mappings": {subject: scores.most_common(1)[0][0] for subject, scores in sorted(subject_scores.items())},
+            "seki_mappings": group_mappings}
+
+# normalized tables of the import, sorted so the same import always gives the same tables:
+# users (students and teachers), groups, memberships (user -> group) and owners (username -> group account)
+def build_snapshot(students, teachers):
+    student_data = students.schild_data
+    teacher_data = teachers.schild_data
+    users = pandas.concat([
+        pandas.DataFrame({"role": "student", "id": student_data["Import-ID"].astype(str).to_numpy(), "first_name": student_data["Vorname"].to_numpy(),
+                          "last_name": student_data["Nachname"].to_numpy(), "grade": student_data["Klasse"].to_numpy(), "untis": None, "username": None,
+                          "groups": student_data["Gruppen"].to_numpy()}),
+        pandas.DataFrame({"role": "teacher", "id": teacher_data["ID"].astype(str).to_numpy(), "first_name": teacher_data["Vorname"].to_numpy(),
+                          "last_name": teacher_data["Nachname"].to_numpy(), "grade": None, "untis": teacher_data["Information"].to_numpy(), "username": teachers.usernames,
+                          "groups": teacher_data["Gruppen"].to_numpy()})], ignore_index=True).astype(object)
+
+    memberships = users[["role", "id"]].assign(group=users.pop("groups").fillna("").str.split(";")).explode("group")
+    memberships = memberships[memberships["group"].str.len() > 0].drop_duplicates()
+    memberships["account"] = memberships["group"].map(get_group_account)
+    owners = pandas.DataFrame(list(teachers.group_owners.owners), columns=["username", "account"]).astype(object)
+
+    accounts = pandas.concat([memberships["account"], owners["account"]]).unique()
+    groups = pandas.DataFrame({"account": accounts})
+    groups["name"] = groups["account"].map(memberships.drop_duplicates("account").set_index("account")["group"])
+    groups["members"] = groups["account"].map(memberships["account"].value_counts()).fillna(0).astype("int64")
+    groups["owners"] = groups["account"].map(owners["account"].value_counts()).fillna(0).astype("int64")
+
+    tables = {"users": users.sort_values(["role", "id"]), "groups": groups.sort_values("account"),
+              "memberships": memberships.sort_values(["role", "id", "group"]), "owners": owners.sort_values(["username", "account"])}
+    # strings are stored dictionary encoded (categorical -> arrow dictionary)
+    for name, table in tables.items():
+        table = table.reset_index(drop=True)
+        for column in table.columns:
+            if(not pandas.api.types.is_numeric_dtype(table[column])):
+                table[column] = table[column].astype("category")
+        tables[name] = table
+    return tables
+
+# fingerprint of the content of a table (independent of the file format)
+def get_table_fingerprint(table):
+    return hashlib.sha1(pandas.util.hash_pandas_object(table, index=False).to_numpy().tobytes()).hexdigest()
+
+# writes the tables as <name>.parquet and a manifest (snapshot.json) with the number of rows and a fingerprint of every
+# table -> comparing two snapshots only needs the manifests, returns the tables which changed since the last snapshot
+def write_snapshot(tables, directory):
+    manifest_file = os.path.join(directory, "snapshot.json")
+    previous = {}
+    if(os.path.exists(manifest_file)):
+        with open(manifest_file, encoding="utf-8") as file:
+            previous = json.load(file)["tables"]
+    os.makedirs(directory, exist_ok=True)
+    manifest = {}
+    for name, table in tables.items():
+        pyarrow.parquet.write_table(pyarrow.Table.from_pandas(table, preserve_index=False), os.path.join(directory, name + ".parquet"))
+        manifest[name] = {"rows": len(table), "fingerprint": get_table_fingerprint(table)}
+    with open(manifest_file, "w", encoding="utf-8") as file:
+        json.dump({"date": time.strftime("%Y-%m-%d %H:%M:%S"), "tables": manifest}, file, indent=1)
+    return {name: (previous[name]["rows"] if name in previous else None, manifest[name]["rows"]) for name in manifest
+            if previous.get(name, {}).get("fingerprint") != manifest[name]["fingerprint"]}
+
+# only checks the source files (--validate), returns if there are no errors
+def ValidateMain():
+    print("### validating source files ###")
+    start = time.perf_counter()
+    errors = validate_sources()
+    error_count = print_validation(errors)
+    print("Validation took", format(time.perf_counter() - start, ".3f"), "s.")
+    sink = open_error_sink(get_file(ERRORS_FILE))
+    errors.write_to(sink, "validation")
+    sink.close()
+    print("Wrote all errors and warnings to", ERRORS_FILE)
+    return error_count == 0
+
+# state: in watch mode the loader (with all parsed sources and indexes) and the formatted students of the last run are
+# reused, the students are only formatted again if they aren't in the state
+def Main(state=None):
     print("-----------------------")
     print("| IServ-Import-Helper |")
     print("-----------------------")
     print()
-    print("### processing students ###")
-    students = Students(get_file(SCHILD_SUS_FILE), get_file(GOMSTH_SUS_FILE), get_file(UNTIS_LUL_FILE), get_file(ISERV_SUS_FILE), VERBOSE)
-    students.read_data()
-    students.format_students()
-    students.write_iserv()
-    control_groups = students.get_control_groups()
-    #control_groups = []
+    if(state is None):
+        state = {}
+    instrumentation = Instrumentation(METRICS_TRACE_MEMORY)
+    loader = state.get("loader")
+    if(loader is None):
+        loader = SourceLoader(get_file(DATA_CACHE) if USE_CACHE else None, instrumentation)
+    loader.instrumentation = instrumentation
+    loader.metrics = []
+    if(VALIDATE_SOURCES):
+        print("### validating source files ###")
+        with instrumentation.stage("validation"):
+            validation_errors = validate_sources(state.setdefault("validator", SourceValidator()))
+        if(print_validation(validation_errors) > 0):
+            sink = open_error_sink(get_file(ERRORS_FILE))
+            validation_errors.write_to(sink, "validation")
+            sink.close()
+            print("Wrote all errors and warnings to", ERRORS_FILE)
+            raise ValueError("the source files have errors - fix them or set VALIDATE_SOURCES to false")
+    delta = DeltaState(get_file(DELTA_STATE_FILE)) if DELTA_MODE else None
+    rules = MappingRules(get_file(MAPPINGS_FILE))
+    students = state.get("students")
+    format_students = students is None
+    if(format_students):
+        students = Students(get_file(SCHILD_SUS_FILE), get_file(GOMSTH_SUS_FILE), get_file(UNTIS_LUL_FILE), get_file(ISERV_SUS_FILE), VERBOSE, STUDENTS_ENGINE, loader, delta, STREAM_OUTPUT, instrumentation, rules)
+    else:
+        print("Students didn't change - using the students of the last run.")
+        if(delta is not None):
+            delta.set_current("students", delta.get_previous("students"))
+    # the student groups are set as soon as the students are formatted
+    teachers = Teachers(get_file(SCHILD_LUL_FILE), get_file(UNTIS_LUL_FILE), get_file(CLASS_TEACHERS_FILE), get_file(ISERV_LUL_FILE), get_file(GROUP_OWNERS_FILE), [], VERBOSE, loader, delta, STREAM_OUTPUT, instrumentation, rules)
+
+    def format_teachers():
+        teachers.set_control_groups_students(students.get_control_groups())
+        teachers.format_teachers()
+
+    def write_teachers():
+        teachers.write_iserv()
+        teachers.write_group_owners_file()
+
+    def snapshot():
+        if(pyarrow is None):
+            print("pyarrow isn't installed - no snapshot is written.")
+            return
+        with instrumentation.stage("snapshot"):
+            changes = write_snapshot(build_snapshot(students, teachers), get_file(SNAPSHOT_DIR))
+        print("Wrote snapshot to", SNAPSHOT_DIR)
+        for name, (previous_rows, rows) in changes.items():
+            if(previous_rows is None):
+                print("Snapshot table", name + ":", rows, "rows (new)")
+            else:
+                print("Snapshot table", name, "changed:", previous_rows, "->", rows, "rows")
+
+    def check_results():
+        print("### checking results ###")
+        with instrumentation.stage("reconciliation"):
+            report = reconcile_groups(teachers.get_control_groups(), students.get_control_groups(), teachers.deleted_groups, students.deleted_groups)
+        print_reconciliation(report)
+        print("### suggested mappings ###")
+        with instrumentation.stage("suggestions"):
+            suggestions = suggest_mappings(students.deleted_groups + teachers.deleted_groups, loader.get_untis_index(get_file(UNTIS_LUL_FILE)), students.get_control_groups() + teachers.get_control_groups(), rules.untis_search)
+        print_suggestions(suggestions)
+        with open(get_file(SUGGESTIONS_FILE), "w", encoding="utf-8") as file:
+            json.dump(get_suggested_mappings(suggestions), file, indent=4, ensure_ascii=False)
+        print("Wrote suggested mappings to", SUGGESTIONS_FILE)
+
+    scheduler = PhaseScheduler(SCHEDULER_THREADS)
+    scheduler.add("read SCHILD_SUS", lambda: loader.read_csv(get_file(SCHILD_SUS_FILE), **SOURCE_OPTIONS["schild"]))
+    scheduler.add("read GOMSTH_SUS", lambda: loader.read_csv(get_file(GOMSTH_SUS_FILE), **SOURCE_OPTIONS["gomsth"]))
+    scheduler.add("read UNTIS_LUL", lambda: loader.get_untis_index(get_file(UNTIS_LUL_FILE)))
+    scheduler.add("read SCHILD_LUL", lambda: loader.read_csv(get_file(SCHILD_LUL_FILE), **SOURCE_OPTIONS["schild"]))
+    scheduler.add("read CLASS_TEACHERS", lambda: loader.read_csv(get_file(CLASS_TEACHERS_FILE), **SOURCE_OPTIONS["class_teachers"]))
+    students_formatted = []
+    if(format_students):
+        scheduler.add("students: read", students.read_data, ["read SCHILD_SUS", "read GOMSTH_SUS", "read UNTIS_LUL"])
+        scheduler.add("students: format", students.format_students, ["students: read"])
+        scheduler.add("students: write", students.write_iserv, ["students: format"])
+        students_formatted = ["students: format"]
+    scheduler.add("teachers: read", teachers.read_data, ["read SCHILD_LUL", "read UNTIS_LUL", "read CLASS_TEACHERS"])
+    scheduler.add("teachers: prepare", teachers.prepare_teachers, ["teachers: read"])
+    scheduler.add("teachers: format", format_teachers, ["teachers: prepare"] + students_formatted)
+    scheduler.add("teachers: write", write_teachers, ["teachers: format"])
+    scheduler.add("check results", check_results, students_formatted + ["teachers: format"])
+    if(WRITE_SNAPSHOT):
+        scheduler.add("write snapshot", snapshot, students_formatted + ["teachers: format"])
+    scheduler.run()
+    state["loader"] = loader
+    state["students"] = students
+
+    if(delta is not None):
+        delta.save()
+    print("----------------------------")
+    print("### source files ###")
+    for metric in loader.metrics:
+        print(os.path.basename(metric["file"]) + ":", "from cache" if metric["cached"] else metric["encoding"], "- detection", round(metric["detection_time"] * 1000, 1), "ms, parsing", round(metric["parse_time"] * 1000, 1), "ms")
     print("----------------------------")
-    print("### processing teachers ###")
-    teachers = Teachers(get_file(SCHILD_LUL_FILE), get_file(UNTIS_LUL_FILE), get_file(CLASS_TEACHERS_FILE), get_file(ISERV_LUL_FILE), get_file(GROUP_OWNERS_FILE), control_groups, VERBOSE)
-    teachers.read_data()
-    teachers.format_teachers()
-    teachers.write_iserv()
-    teachers.write_group_owners_file()
+    print("### phases ###")
+    scheduler.print_summary()
+    print("----------------------------")
+    print("### errors ###")
+    print("source\ttype\tshort\tcount")
+    sink = open_error_sink(get_file(ERRORS_FILE))
+    if(VALIDATE_SOURCES):
+        validation_errors.write_to(sink, "validation")
+    for source, errors in [("students", students.errors), ("teachers", teachers.errors)]:
+        for (type, short), count in errors.get_summary().most_common():
+            print(source + "\t" + type + "\t" + short + "\t" + str(count))
+        errors.write_to(sink, source)
+    sink.close()
+    print("Wrote all errors and warnings to", ERRORS_FILE)
+    print("----------------------------")
+    print("### stages ###")
+    instrumentation.print_summary()
+    instrumentation.write_json(get_file(METRICS_FILE), phases={name: {"start": start, "end": end} for name, (start, end) in scheduler.timings.items()}, critical_path=scheduler.get_critical_path(), sources=loader.metrics)
+    print("Wrote metrics to", METRICS_FILE)
+    print("done")
+    return {"students": len(students.schild_data), "teachers": len(teachers.schild_data), "errors": len(students.errors) + len(teachers.errors), "phases": scheduler.timings,
+            "critical_path": scheduler.get_critical_path()}
+
+# imports again whenever a source file or the mappings file changes; only the changed files are parsed again and the
+# students are only formatted again if their sources or the mappings changed
+def WatchMain(interval):
+    files = {name: get_file(globals()[name]) for name in ["SCHILD_SUS_FILE", "GOMSTH_SUS_FILE", "UNTIS_LUL_FILE", "SCHILD_LUL_FILE", "CLASS_TEACHERS_FILE", "MAPPINGS_FILE"]}
+    students_files = ["SCHILD_SUS_FILE", "GOMSTH_SUS_FILE", "UNTIS_LUL_FILE", "MAPPINGS_FILE"]
+    versions = {name: get_file_version(file) for name, file in files.items()}
+    state = {}
+    try:
+        while(True):
+            start = time.perf_counter()
+            try:
+                Main(state)
+            except Exception:
+                # e.g. a file which is saved at the moment -> try again after the next change
+                traceback.print_exc()
+            print("Import took", format(time.perf_counter() - start, ".3f"), "s. Watching", DATA_SRC, "and", MAPPINGS_FILE, "for changes (stop with Ctrl+C) ...")
+            changed = []
+            while(len(changed) == 0):
+                time.sleep(interval)
+                for name, file in files.items():
+                    version = get_file_version(file)
+                    if(version != versions[name]):
+                        versions[name] = version
+                        changed.append(name)
+            print()
+            print("Changed:", ", ".join(os.path.basename(files[name]) for name in changed))
+            for name in changed:
+                if("loader" in state):
+                    state["loader"].forget(files[name])
+                if(name in students_files):
+                    state.pop("students", None)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+# constants with paths -> relative paths in school configs are relative to the config file
+PATH_CONSTANTS = ["DATA_SRC", "DATA_OUT", "DATA_CACHE", "DELTA_STATE_FILE", "SCHILD_SUS_FILE", "GOMSTH_SUS_FILE", "SCHILD_LUL_FILE", "UNTIS_LUL_FILE", "CLASS_TEACHERS_FILE", "ISERV_SUS_FILE", "ISERV_LUL_FILE", "GROUP_OWNERS_FILE", "METRICS_FILE", "ERRORS_FILE", "SUGGESTIONS_FILE", "SNAPSHOT_DIR", "MAPPINGS_FILE"]
+
+# overwrites the constants with the values of a school config; the data of school xy is in <config dir>/xy/data-src/ etc. by default
+def apply_school_config(config_file):
+    school = os.path.splitext(os.path.basename(config_file))[0]
+    config_dir = os.path.dirname(os.path.abspath(config_file))
+    with open(config_file, encoding="utf-8") as file:
+        config = json.load(file)
+    for name in config:
+        if(name not in globals() or not name.isupper()):
+            raise ValueError("unknown constant " + name + " in " + config_file)
+    constants = globals()
+    # the files keep their names but are placed in the directories of the school
+    directories = {}
+    for directory in ["DATA_SRC", "DATA_OUT", "DATA_CACHE"]:
+        directories[directory] = os.path.join(config_dir, config.get(directory, os.path.join(school, constants[directory])))
+    for name in ["SCHILD_SUS_FILE", "GOMSTH_SUS_FILE", "SCHILD_LUL_FILE", "UNTIS_LUL_FILE", "CLASS_TEACHERS_FILE"]:
+        constants[name] = os.path.join(directories["DATA_SRC"], os.path.basename(constants[name]))
+    for name in ["ISERV_SUS_FILE", "ISERV_LUL_FILE", "GROUP_OWNERS_FILE", "METRICS_FILE", "ERRORS_FILE", "SUGGESTIONS_FILE"]:
+        constants[name] = os.path.join(directories["DATA_OUT"], os.path.basename(constants[name]))
+    constants["DELTA_STATE_FILE"] = os.path.join(directories["DATA_CACHE"], os.path.basename(DELTA_STATE_FILE))
+    constants["MAPPINGS_FILE"] = os.path.join(config_dir, school, os.path.basename(MAPPINGS_FILE))
+    constants["SNAPSHOT_DIR"] = os.path.join(directories["DATA_OUT"], os.path.basename(os.path.normpath(SNAPSHOT_DIR)), "")
+    constants.update(directories)
+    for name, value in config.items():
+        if(name in PATH_CONSTANTS):
+            value = os.path.join(config_dir, value)
+        constants[name] = value
+    # constants which are used when the script is loaded
+    if("GOMSTH_COURSE_COLUMNS" not in config):
+        constants["GOMSTH_COURSE_COLUMNS"] = get_gomsth_course_columns(GOMSTH_MAX_COURSES)
+    if("SOURCE_OPTIONS" not in config):
+        constants["SOURCE_OPTIONS"] = get_source_options(GOMSTH_COURSE_COLUMNS)
+    constants["parse_grade"] = functools.lru_cache(maxsize=GRADE_CACHE_SIZE)(parse_grade.__wrapped__)
+    constants["normalize_main_name"] = functools.lru_cache(maxsize=MAIN_NAME_CACHE_SIZE)(normalize_main_name.__wrapped__)
+    return school
+
+# runs the import for one school in its own process, the output is written to <DATA_OUT>/log.txt
+def run_school(config_file):
+    result = {"school": os.path.splitext(os.path.basename(config_file))[0], "status": "failed", "students": "", "teachers": "", "errors": "", "time": 0, "phase time": "", "critical path": "", "log": ""}
+    start = time.perf_counter()
+    try:
+        result["school"] = apply_school_config(config_file)
+        os.makedirs(DATA_OUT, exist_ok=True)
+        result["log"] = os.path.join(DATA_OUT, "log.txt")
+        with open(result["log"], "w", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+            try:
+                summary = Main()
+            except Exception:
+                traceback.print_exc(file=log)
+                raise
+        result.update({"status": "ok", "students": summary["students"], "teachers": summary["teachers"], "errors": summary["errors"]})
+        if(len(summary["phases"]) > 0):
+            # end of the last phase (without reading the config and starting the process)
+            result["phase time"] = max(phase_end for phase_start, phase_end in summary["phases"].values())
+            result["critical path"] = " -> ".join(summary["critical_path"])
+    except Exception as exception:
+        result["status"] = "failed: " + type(exception).__name__ + ": " + str(exception)
+    result["time"] = time.perf_counter() - start
+    return result
+
+def BatchMain(schools_dir):
+    print("-----------------------")
+    print("| IServ-Import-Helper |")
+    print("-----------------------")
+    print()
+    config_files = sorted(os.path.join(schools_dir, file) for file in os.listdir(schools_dir) if file.endswith(".json"))
+    print("Importing", len(config_files), "schools with", BATCH_PROCESSES, "processes ...")
+    start = time.perf_counter()
+    results = []
+    # every school gets a new process, so the constants of one school can't leak into the next one
+    with multiprocessing.Pool(BATCH_PROCESSES, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(run_school, config_files):
+            print(result["school"] + ":", result["status"], "(" + format(result["time"], ".2f"), "s)")
+            results.append(result)
+    total_time = time.perf_counter() - start
+    results.sort(key=lambda result: result["school"])
+
     print("----------------------------")
-    print("### checking results ###")
-    find_students_only_groups(teachers.get_control_groups(), control_groups)
-    find_deletion_mismatches(teachers.deleted_groups, students.deleted_groups)
+    print("### batch summary ###")
+    columns = ["school", "status", "students", "teachers", "errors", "time", "phase time", "critical path", "log"]
+    print("\t".join(columns))
+    for result in results:
+        print("\t".join(format(result[column], ".2f") if isinstance(result[column], float) else str(result[column]) for column in columns))
+    failed = [result for result in results if result["status"] != "ok"]
+    print(len(results) - len(failed), "of", len(results), "schools imported in", format(total_time, ".2f"), "s (" + format(sum(result["time"] for result in results), ".2f"), "s one after another)")
+    with open(os.path.join(schools_dir, BATCH_SUMMARY_FILE), "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, columns, delimiter=";", extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows([{column: round(value, 3) if isinstance(value, float) else value for column, value in result.items()} for result in results])
     print("done")
+    return len(failed) == 0
 
 if __name__ == "__main__":
-    Main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Convert SchILD, Untis and GomSTH data to import files for iServ.")
+    parser.add_argument("--batch", nargs="?", const=SCHOOLS_DIR, metavar="SCHOOLS_DIR", help="import all schools configured in SCHOOLS_DIR (default: " + SCHOOLS_DIR + ")")
+    parser.add_argument("--watch", action="store_true", help="keep the sources in memory and import again whenever they or the mappings change")
+    parser.add_argument("--validate", action="store_true", help="only check the source files for missing columns, invalid grades and duplicate keys")
+    arguments = parser.parse_args()
+    if(arguments.batch is not None):
+        if(not BatchMain(get_file(arguments.batch))):
+            sys.exit(1)
+    elif(arguments.watch):
+        WatchMain(WATCH_INTERVAL)
+    elif(arguments.validate):
+        if(not ValidateMain()):
+            sys.exit(1)
+    else:
+        Main()
\ No newline at end of file